@@ -32,320 +32,1162 @@ You should have received a copy of the GNU General Public License along with thi
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import csv
+import functools
+import hashlib
+import http.client
+import inspect
+import io
+import json
+import operator
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
 import pandas as pd
+import matplotlib
+import matplotlib.path
 import matplotlib.pyplot as plt
 import seaborn as sns
 import folium
 import geojson
 from sklearn import linear_model
 from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.preprocessing import PolynomialFeatures
+try:
+    import pyarrow # pylint: disable=unused-import
+    ARTIFACT_FORMAT = "parquet"
+except ImportError:
+    # pickle keeps dtypes too, it just isn't columnar
+    ARTIFACT_FORMAT = "pkl"
+try:
+    import resource
+except ImportError:
+    # there is no resource module on Windows, so traces have no peak RSS there
+    resource = None
+
+# Set this environment variable to a file name to trace the pipeline (see StepTracer).
+# Worker processes see it too, so their steps end up in the same trace.
+TRACE_ENVIRONMENT_VARIABLE = "PIPELINE_TRACE"
+
+def peak_rss_mb():
+    """
+    Returns the most memory (resident set size) this process has used so far, in MB,
+    or None where the resource module is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def count_rows(values)->int:
+    """
+    This function takes one input:
+    values: a list of arguments or outputs of a step.
+
+    Returns the total number of rows of the DataFrames and Series in values
+    (also looking one level into tuples, lists and dicts), or None if there are none.
+    """
+    frames = []
+    for value in values:
+        if isinstance(value, dict):
+            value = list(value.values())
+        if not isinstance(value, (tuple, list)):
+            value = [value]
+        frames += [item for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+    return sum(len(frame) for frame in frames) if frames else None
+
+class StepTracer:
+    """
+    Records how long each traced step takes, as events in the Chrome trace format
+    (see traced()). The saved trace opens in chrome://tracing, Perfetto or speedscope,
+    where steps called by other steps show up nested under them.
+
+    Every event holds the step's wall time (its duration), CPU time, peak RSS,
+    the rows going in and out, and the year it was run for (if it takes one).
+    Tracing is off unless a trace file is set; when it is off a traced step costs
+    one extra function call.
+    """
+    def __init__(self, trace_file: str = None):
+        """
+        This function takes one input:
+        trace_file: the file the trace is saved to, or None to not trace.
+        """
+        self.trace_file = trace_file
+        self.events = []
+        self.started = time.time_ns()
+
+    @property
+    def enabled(self)->bool:
+        """
+        Whether steps are traced.
+        """
+        return self.trace_file is not None
+
+    def call(self, name: str, function, args: tuple, kwargs: dict, details: dict):
+        """
+        This function takes five inputs:
+        name: the name of the event.
+        function: the step to run.
+        args, kwargs: the arguments to run it with.
+        details: more details to save with the event (e.g. the year).
+
+        Runs function(*args, **kwargs), records an event for it and returns its output.
+        """
+        rss_before = peak_rss_mb()
+        cpu_start = time.process_time_ns()
+        start = time.time_ns()
+        output = function(*args, **kwargs)
+        end = time.time_ns()
+        details = dict(details,
+                       cpu_ms=(time.process_time_ns() - cpu_start) / 1e6,
+                       rows_in=count_rows(list(args) + list(kwargs.values())),
+                       rows_out=count_rows([output]))
+        if rss_before is not None:
+            details["peak_rss_mb"] = peak_rss_mb()
+            details["peak_rss_growth_mb"] = details["peak_rss_mb"] - rss_before
+        # timestamps and durations are in microseconds
+        self.events.append({"name": name, "cat": "step", "ph": "X",
+                            "ts": start / 1000, "dur": (end - start) / 1000,
+                            "pid": os.getpid(), "tid": threading.get_native_id(),
+                            "args": details})
+        return output
+
+    def save(self, trace_file: str = None):
+        """
+        This function takes one input:
+        trace_file: the file to save the trace to (self.trace_file if not given).
+
+        Saves every event so far as a Chrome trace .json file. Timestamps are saved relative to
+        when the tracer was made, so the traces of two runs can be compared line by line.
+        """
+        events = sorted(({**event, "ts": event["ts"] - self.started / 1000}
+                         for event in self.events), key=lambda event: event["ts"])
+        with open(trace_file or self.trace_file, mode="w", encoding="utf_8") as trace:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace, indent=1)
+
+TRACER = StepTracer(os.environ.get(TRACE_ENVIRONMENT_VARIABLE))
+
+def traced(function):
+    """
+    This function takes one input:
+    function: a pipeline step.
+
+    A decorator that records every call of the step with TRACER while tracing is on.
+    Steps that take a year are recorded as "<step name> <year>".
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def traced_function(*args, **kwargs):
+        if not TRACER.enabled:
+            return function(*args, **kwargs)
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+        details = {"year": arguments["year"]} if "year" in arguments else {}
+        name = f"{function.__name__} {arguments['year']}" if "year" in arguments \
+            else function.__name__
+        return TRACER.call(name, function, args, kwargs, details)
+    return traced_function
+
+def call_traced(function, *args)->tuple:
+    """
+    This function takes one or more inputs:
+    function: a function to run in a worker process.
+    args: the arguments to run it with.
 
-def import_housing(csv_name: str, columns_to_use: dict)->pd.DataFrame:
+    Returns the output of function(*args) and the trace events recorded while it ran,
+    so the process that started the worker can add them to its own trace.
+    """
+    first_event = len(TRACER.events)
+    output = function(*args)
+    events = TRACER.events[first_event:]
+    del TRACER.events[first_event:]
+    return output, events
+
+def summarize_trace(trace_file: str)->pd.DataFrame:
+    """
+    This function takes one input:
+    trace_file: a trace saved by StepTracer.save().
+
+    Returns one row per event name with its number of calls, total wall and CPU seconds,
+    highest peak RSS and total rows in and out, sorted by wall time.
+    Two runs can be compared by comparing the summaries of their traces.
+    """
+    with open(trace_file, mode="r", encoding="utf_8") as trace:
+        events = json.load(trace)["traceEvents"]
+    df_events = pd.DataFrame({"Step": [event["name"] for event in events],
+                              "Wall Seconds": [event["dur"] / 1e6 for event in events]})
+    df_details = pd.DataFrame([event["args"] for event in events])
+    df_events["CPU Seconds"] = df_details["cpu_ms"] / 1000
+    df_events["Peak RSS MB"] = df_details.get("peak_rss_mb")
+    df_events["Rows In"] = df_details["rows_in"]
+    df_events["Rows Out"] = df_details["rows_out"]
+    return df_events.groupby("Step", sort=False)\
+                    .agg(Calls=("Wall Seconds", "size"),
+                         **{"Wall Seconds": ("Wall Seconds", "sum"),
+                            "CPU Seconds": ("CPU Seconds", "sum"),
+                            "Peak RSS MB": ("Peak RSS MB", "max"),
+                            "Rows In": ("Rows In", "sum"),
+                            "Rows Out": ("Rows Out", "sum")})\
+                    .sort_values("Wall Seconds", ascending=False)
+
+# Unit count columns of the Affordable Housing data.
+HOUSING_COUNT_COLUMNS = ["Extremely Low Income Units",
+                         "Very Low Income Units",
+                         "Low Income Units",
+                         "Moderate Income Units",
+                         "Middle Income Units",
+                         "All Counted Units",
+                         "Total Units"]
+# Dtypes for the raw Affordable Housing columns, applied while the csv is parsed.
+# Census Tract and the dates are pinned to strings so every chunk of a streamed read
+# gets the same dtypes (a chunk of all-numeric tracts would otherwise become floats).
+# The unit counts are read as wide nullable ints, since read_csv wraps values that overflow
+# a small int without an error, and since some can be blank. They are narrowed by
+# apply_schema(), which checks the range, once impute_housing() has filled the blanks.
+HOUSING_CSV_DTYPES = {"Project ID": "Int32",
+                      "Project Start Date": "str",
+                      "Project Completion Date": "str",
+                      "Building Completion Date": "str",
+                      "Census Tract": "str",
+                      "Borough": "category",
+                      "Postcode": "float32",
+                      "NTA - Neighborhood Tabulation Area": "category",
+                      "Reporting Construction Type": "category",
+                      "Extended Affordability Only": "category",
+                      **{col: "Int32" for col in HOUSING_COUNT_COLUMNS},
+                      "Latitude": "float64",
+                      "Longitude": "float64"}
+# Compact dtypes of the columns impute_housing() fills in, adds or narrows (see apply_schema()).
+# The tracts and building completion dates are read as strings (see above) and made
+# categorical by impute_housing(), once per chunk of a streamed read.
+HOUSING_SCHEMA = {"Postcode": "int32",
+                  "Census Tract": "category",
+                  "Building Completion Date": "category",
+                  **{col: "int16" for col in HOUSING_COUNT_COLUMNS},
+                  "Project Start Year": "int16",
+                  "Project End Year": "int16",
+                  "Percent": "float32"}
+# Building coordinates, read along with the kept columns to place buildings without a Postcode.
+HOUSING_COORDINATE_COLUMNS = ["Latitude", "Longitude"]
+
+@traced
+def apply_schema(df: pd.DataFrame, schema: dict)->pd.DataFrame:
     """
     This function takes two inputs:
+    df: a DataFrame.
+    schema: a dict of column names and the dtypes they should have.
+
+    Returns df with every column of the schema converted to its dtype
+    (columns the DataFrame doesn't have are skipped).
+    Raises a ValueError instead of letting a value overflow a smaller integer dtype.
+    """
+    columns = {col: dtype for col, dtype in schema.items() if col in df.columns}
+    for col, dtype in columns.items():
+        if pd.api.types.is_integer_dtype(dtype) and pd.api.types.is_numeric_dtype(df[col]) \
+                and len(df) > 0:
+            limits = np.iinfo(dtype)
+            if df[col].min() < limits.min or df[col].max() > limits.max:
+                raise ValueError(f"{col} has values that do not fit in {dtype}")
+    return df.astype(columns)
+
+def read_housing_csv(csv_name: str, columns_to_use: list, chunksize: int = None):
+    """
+    This function takes three inputs:
+    csv_name: the name of an Affordable Housing in NYC .csv file to read.
+    columns_to_use: a list of columns to keep (an empty list keeps every column).
+    chunksize: if given, the number of rows to read at a time.
+
+    Only the columns in columns_to_use are parsed, using the dtypes in HOUSING_CSV_DTYPES.
+
+    Returns a DataFrame, or an iterator of DataFrames of at most chunksize rows.
+    """
+    usecols = columns_to_use if columns_to_use != [] else None
+    reader = pd.read_csv(csv_name, usecols=usecols, dtype=HOUSING_CSV_DTYPES,
+                         chunksize=chunksize)
+    if usecols is None:
+        return reader
+    # usecols keeps the column order of the file, this puts them back in the given order
+    if chunksize is None:
+        return reader[columns_to_use]
+    return (chunk[columns_to_use] for chunk in reader)
+
+def coordinate_columns_to_add(columns_to_use: list)->list:
+    """
+    This function takes one input:
+    columns_to_use: a list of columns to keep (an empty list keeps every column).
+
+    Returns the coordinate columns that have to be read on top of columns_to_use
+    so impute_housing() can place buildings, and dropped again afterwards.
+    """
+    if columns_to_use == []:
+        return []
+    return [col for col in HOUSING_COORDINATE_COLUMNS if col not in columns_to_use]
+
+def import_housing(csv_name: str, columns_to_use: list, zip_index=None)->pd.DataFrame:
+    """
+    This function takes three inputs:
     csv_name: the name of an Affordable Housing in NYC .csv file to read.
     columns_to_use: a list of columns to keep.
+    zip_index: a ZipIndex passed on to impute_housing() (loaded there if not given).
 
     The data in the .csv file is read into a DataFrame.
-    If a valid list of columns is provided, only those columns will be kept.
+    If a valid list of columns is provided, only those columns will be read
+    (plus the building coordinates, which are dropped again after imputing).
     The DataFrame is then passed to impute_housing().
 
     Returns an imputed version of the DataFrame.
     """
-    df = pd.read_csv(csv_name)
-    if columns_to_use != []:
-        df = df[columns_to_use]
+    extra_columns = coordinate_columns_to_add(columns_to_use)
+    df = read_housing_csv(csv_name, columns_to_use + extra_columns)
     #print("Finished importing; printing some sample columns")
-    return impute_housing(df)
+    return impute_housing(df, zip_index).drop(columns=extra_columns)
 
-def choose_date(date, default_date):
+def import_housing_chunks(csv_name: str, columns_to_use: list, chunksize: int, zip_index=None):
     """
-    This function takes two inputs:
-    date: a potentially NaN date.
-    default_date: a non-NaN default date to return.
+    This function takes four inputs:
+    csv_name: the name of an Affordable Housing in NYC .csv file to read.
+    columns_to_use: a list of columns to keep.
+    chunksize: the number of rows to read and impute at a time.
+    zip_index: a ZipIndex passed on to impute_housing() (loaded if not given).
 
-    Returns date if it is not NaN, or default_date otherwise.
+    A streaming version of import_housing(): every chunk of the .csv file is
+    passed to impute_housing() on its own, so only one chunk is in memory at a time.
+
+    Yields imputed DataFrames of at most chunksize rows.
+    """
+    if zip_index is None:
+        zip_index = load_zip_index()
+    extra_columns = coordinate_columns_to_add(columns_to_use)
+    for chunk in read_housing_csv(csv_name, columns_to_use + extra_columns, chunksize):
+        yield impute_housing(chunk, zip_index).drop(columns=extra_columns)
+
+# Default ZIP codes used for buildings without a Postcode, keyed by borough.
+# Based on impute_zip() in Assignment 4.
+BORO_DEFAULT_ZIPS = {"Bronx": 10451,
+                     "Brooklyn": 11201,
+                     "Manhattan": 10001,
+                     "Queens": 11431,
+                     "Staten Island": 10341}
+
+class ZipIndex:
     """
-    if pd.isna(date):
-        return pd.to_datetime(default_date)
-    return pd.to_datetime(date)
+    A lookup table of attributes (Borough, Neighborhood) for NYC zip codes.
 
-def choose_postcode(postcode, boro):
+    The zip codes are stored as a sorted integer array so that a whole column of zips
+    can be looked up at once with a binary search, instead of filtering the zip table
+    once per row.
+    Self note: Had to manually add a couple of zipcodes to nyc_zips_and_boros.csv.
     """
-    This function takes two inputs:
-    postcode: a potentially NaN zip code.
-    boro: a non-NaN string containing a borough.
+    def __init__(self, df_zips: pd.DataFrame, boro_default_zips: dict):
+        """
+        This function takes two inputs:
+        df_zips: a DataFrame with a "ZipCode" column and one column per zip attribute.
+        boro_default_zips: a dict of boroughs and the zip to use for buildings without one.
+        """
+        df_zips = df_zips.drop_duplicates("ZipCode").sort_values("ZipCode")
+        self.zips = df_zips["ZipCode"].to_numpy(dtype=np.int64)
+        self.attributes = {col: df_zips[col].to_numpy(dtype=object)
+                           for col in df_zips.columns if col != "ZipCode"}
+        self.boro_default_zips = boro_default_zips
+
+    def lookup(self, zips, attribute: str = "Borough")->np.ndarray:
+        """
+        This function takes two inputs:
+        zips: a list, array or Series of zip codes.
+        attribute: the zip attribute to return.
 
-    Returns postcode if it is not empty, or the ZIP corresponding to boro otherwise.
+        Returns an array with the attribute of every zip.
+        ZIP 10000 (all of NYC) returns "New York" and unknown zips return "Other".
+        """
+        zips = np.asarray(zips, dtype=np.int64)
+        positions = np.searchsorted(self.zips, zips).clip(max=len(self.zips) - 1)
+        found = self.zips[positions] == zips
+        output = np.where(found, self.attributes[attribute][positions], "Other").astype(object)
+        output[zips == 10000] = "New York"
+        return output
 
-    Based on impute_zip() in Assignment 4.
-    """
-    #print("Choosing postcode or boro")
-    boro_dict = {"Bronx": 10451,
-                "Brooklyn": 11201,
-                "Manhattan": 10001,
-                "Queens": 11431,
-                "Staten Island": 10341}
-    if pd.isna(postcode):
-        return boro_dict[boro]
-    return postcode
+    def default_zips(self, boroughs: pd.Series)->pd.Series:
+        """
+        This function takes one input:
+        boroughs: a Series of boroughs.
+
+        Returns the default zip of every borough in the Series.
+        """
+        # astype(float) since a categorical Series of boroughs maps to a categorical of zips
+        return boroughs.map(self.boro_default_zips).astype(float)
 
-def impute_housing(df: pd.DataFrame)->pd.DataFrame:
+@functools.lru_cache(maxsize=None)
+def load_zip_index(csv_name: str = "nyc_zipcodes_and_boros.csv")->ZipIndex:
     """
     This function takes one input:
-    df: a DataFrame object containing Affordable Housing Unit data.
-
-    Missing values in the following columns are replaced with the following default values:
-    Project Completion Date: January 1, 2024
-    Postcode: the default post-codes of each borough
+    csv_name: the name of a .csv file of NYC boroughs, neighborhoods and zip codes.
 
-    The following columns will be added to the DataFrame:
-    Project Start Year: year project starts
-    Project End Year: year project ends
-    Percent: All Counted Units / Total Units
+    The file is only read the first time a given csv_name is asked for;
+    later calls return the same ZipIndex.
 
-    The imputing will be done "manually" (unique code for every column).
-    This is bad coding form, but circumstances make a more "elegant" solution difficult.
+    Returns a ZipIndex built from the file.
+    """
+    return ZipIndex(pd.read_csv(csv_name), BORO_DEFAULT_ZIPS)
+
+# Number of entries in each node of the STR tree over the ZCTA polygons.
+STR_NODE_CAPACITY = 8
+# The edges of every polygon are also bucketed into this many horizontal bands,
+# so a point is only tested against the edges at its own latitude.
+ZCTA_EDGE_BANDS = 4096
+# Points are placed into ZCTAs this many at a time, which bounds the memory used
+# by the (point, polygon edge) pairs that are tested.
+ZCTA_JOIN_CHUNK_SIZE = 50000
+
+def str_order(bounds: np.ndarray, capacity: int)->np.ndarray:
+    """
+    This function takes two inputs:
+    bounds: an (n x 4) array of bounding boxes (min x, min y, max x, max y).
+    capacity: the number of boxes per node.
 
-    Returns the imputed DataFrame.
+    Returns the Sort-Tile-Recursive order of the boxes: the boxes are cut into vertical
+    slices by their center x, and sorted by their center y within each slice,
+    so every run of capacity boxes in this order makes a compact node.
     """
+    centers = (bounds[:, :2] + bounds[:, 2:]) / 2
+    num_slices = int(np.ceil(np.sqrt(np.ceil(len(bounds) / capacity))))
+    slice_size = num_slices * capacity
+    slice_of = np.empty(len(bounds), dtype=np.int64)
+    slice_of[np.argsort(centers[:, 0], kind="stable")] = np.arange(len(bounds)) // slice_size
+    return np.lexsort((centers[:, 1], slice_of))
+
+def expand_ranges(starts: np.ndarray, ends: np.ndarray)->tuple:
+    """
+    This function takes two inputs:
+    starts, ends: arrays of the first and one past the last position of some ranges.
 
-    df["Project Completion Date"] = df["Project Completion Date"]\
-                                .apply(lambda date: choose_date(date,"01/01/2024"))
-    df["Project Start Date"] = df["Project Start Date"]\
-                                .apply(lambda date: choose_date(date,"01/01/2024"))
+    Returns the index of the range of every position in the ranges, and the positions,
+    e.g. starts [0, 5] and ends [2, 7] return [0, 0, 1, 1] and [0, 1, 5, 6].
+    """
+    counts = ends - starts
+    owners = np.repeat(np.arange(len(starts)), counts)
+    positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return owners, positions
 
-    df["Postcode"] = df.apply(lambda row: choose_postcode(row["Postcode"], row["Borough"]),
-                              axis=1)
-    df["Postcode"] = df["Postcode"].apply(int)
+class ZctaIndex:
+    """
+    An STR packed R-tree over the ZIP code tabulation area polygons, for finding the ZCTA
+    of many points (longitude, latitude) at once.
+
+    Every polygon of every ZCTA is one leaf entry, and the entries are packed into nodes
+    of STR_NODE_CAPACITY boxes bottom up. A lookup walks all the points down the tree
+    together, keeping only the (point, node) pairs whose box holds the point, and finally
+    runs an even-odd ray crossing test of each point against the edges of its few
+    candidate polygons that lie in the point's horizontal band. Every step is done with
+    whole arrays, not per point.
+    """
+    def __init__(self, zips, capacity: int = STR_NODE_CAPACITY):
+        """
+        This function takes two inputs:
+        zips: a parsed geojson of ZIP code tabulation areas (see load_zcta_geojson()).
+        capacity: the number of entries per tree node.
+        """
+        polygon_zips = []
+        polygon_edges = []
+        for feature in zips["features"]:
+            geometry = feature["geometry"]
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" \
+                else geometry["coordinates"]
+            for polygon in polygons:
+                rings = [np.asarray(ring, dtype=float)[:, :2] for ring in polygon]
+                # each ring is closed, so its edges are every pair of neighbouring points.
+                # holes are just more edges for the even-odd test
+                polygon_edges.append(np.concatenate([np.hstack([ring[:-1], ring[1:]])
+                                                     for ring in rings]))
+                polygon_zips.append(int(feature["properties"]["postalCode"]))
+        bounds = np.array([[edges[:, [0, 2]].min(), edges[:, [1, 3]].min(),
+                            edges[:, [0, 2]].max(), edges[:, [1, 3]].max()]
+                           for edges in polygon_edges])
+
+        # the leaves: the polygons themselves, in STR order
+        order = str_order(bounds, capacity)
+        self.polygon_zips = np.array(polygon_zips, dtype=np.int64)[order]
+        # where each polygon was in the file
+        self.polygon_positions = order
+        self.polygon_bounds = bounds[order]
+        polygon_edges = [polygon_edges[position] for position in order]
+        self.edges = np.concatenate(polygon_edges)
+        edge_polygons = np.repeat(np.arange(len(polygon_edges)),
+                                  [len(edges) for edges in polygon_edges])
+
+        # every edge is listed under each (polygon, band) it reaches,
+        # as ranges of band_edges sorted by polygon * ZCTA_EDGE_BANDS + band
+        self.band_bottom = self.polygon_bounds[:, 1].min()
+        self.band_height = (self.polygon_bounds[:, 3].max() - self.band_bottom) / ZCTA_EDGE_BANDS
+        owners, bands = expand_ranges(self.band_of(self.edges[:, [1, 3]].min(axis=1)),
+                                      self.band_of(self.edges[:, [1, 3]].max(axis=1)) + 1)
+        band_keys = edge_polygons[owners] * ZCTA_EDGE_BANDS + bands
+        order = np.argsort(band_keys, kind="stable")
+        self.band_edges = owners[order]
+        self.band_keys, self.band_starts = np.unique(band_keys[order], return_index=True)
+        self.band_starts = np.append(self.band_starts, len(order))
+
+        # every level is (node boxes, first child, one past the last child),
+        # built from the leaves up and stored from the root down.
+        # the children of the lowest level are polygons
+        self.levels = []
+        entry_bounds = self.polygon_bounds
+        while len(entry_bounds) > 1 or not self.levels:
+            starts = np.arange(0, len(entry_bounds), capacity)
+            ends = np.minimum(starts + capacity, len(entry_bounds))
+            node_bounds = np.hstack([np.minimum.reduceat(entry_bounds[:, :2], starts),
+                                     np.maximum.reduceat(entry_bounds[:, 2:], starts)])
+            # the nodes are put in STR order too, so the next level groups nearby nodes
+            order = str_order(node_bounds, capacity)
+            # boxes are stored as (min x, min y, max x, max y) columns for the lookups
+            self.levels.insert(0, (node_bounds[order].T.copy(), starts[order], ends[order]))
+            entry_bounds = node_bounds[order]
+        self.polygon_box_columns = self.polygon_bounds.T.copy()
+
+    def band_of(self, latitudes: np.ndarray)->np.ndarray:
+        """
+        This function takes one input:
+        latitudes: an array of latitudes.
 
-    df["Project Start Year"] = df["Project Start Date"]\
-                            .apply(lambda date: date.year)
+        Returns the horizontal band of every latitude (see ZCTA_EDGE_BANDS).
+        """
+        return np.floor((latitudes - self.band_bottom) / self.band_height)\
+            .clip(0, ZCTA_EDGE_BANDS - 1).astype(np.int64)
 
-    df["Project End Year"] = df["Project Completion Date"]\
-                            .apply(lambda date: date.year)
+    def query_chunk(self, points: np.ndarray)->np.ndarray:
+        """
+        This function takes one input:
+        points: an (n x 2) array of (longitude, latitude) points.
 
-    df["Percent"] = 0.0
-    df["Percent"] = df["All Counted Units"] / df["Total Units"]
-    # 3 places after the decimal should be enough precision here
-    df["Percent"] = df["Percent"].apply(lambda percent: round(percent, 3))
-    return df
+        Returns the ZCTA of every point, or 0 for points outside every ZCTA.
+        """
+        x_all, y_all = points[:, 0], points[:, 1]
+
+        def in_boxes(bounds: np.ndarray, point_ids: np.ndarray, entry_ids: np.ndarray)->tuple:
+            # keeps the (point, entry) pairs whose entry box holds the point
+            x_points, y_points = x_all[point_ids], y_all[point_ids]
+            inside = (x_points >= bounds[0][entry_ids]) & (x_points <= bounds[2][entry_ids])
+            inside &= (y_points >= bounds[1][entry_ids]) & (y_points <= bounds[3][entry_ids])
+            return point_ids[inside], entry_ids[inside]
+
+        # (point, entry) pairs to check, starting with every point against the root
+        point_ids = np.arange(len(points))
+        entry_ids = np.zeros(len(points), dtype=np.int64)
+        for node_bounds, starts, ends in self.levels:
+            point_ids, entry_ids = in_boxes(node_bounds, point_ids, entry_ids)
+            owners, entry_ids = expand_ranges(starts[entry_ids], ends[entry_ids])
+            point_ids = point_ids[owners]
+        # entry_ids are polygons now
+        point_ids, entry_ids = in_boxes(self.polygon_box_columns, point_ids, entry_ids)
+
+        # a point is inside a polygon if a ray going right from it crosses an odd number of edges.
+        # only the edges in the point's band can cross that ray
+        keys = entry_ids * ZCTA_EDGE_BANDS + self.band_of(points[point_ids, 1])
+        positions = np.searchsorted(self.band_keys, keys).clip(max=len(self.band_keys) - 1)
+        listed = self.band_keys[positions] == keys
+        owners, edge_ids = expand_ranges(np.where(listed, self.band_starts[positions], 0),
+                                         np.where(listed, self.band_starts[positions + 1], 0))
+        edge_ids = self.band_edges[edge_ids]
+        x_points, y_points = points[point_ids[owners], 0], points[point_ids[owners], 1]
+        x_1, y_1, x_2, y_2 = self.edges[edge_ids].T
+        straddles = (y_1 > y_points) != (y_2 > y_points)
+        crosses = np.zeros(len(owners), dtype=bool)
+        crosses[straddles] = x_points[straddles] < \
+            x_1[straddles] + (y_points[straddles] - y_1[straddles]) * \
+            (x_2[straddles] - x_1[straddles]) / (y_2[straddles] - y_1[straddles])
+        crossings = np.bincount(owners, weights=crosses, minlength=len(point_ids))
+        contained = crossings % 2 == 1
+
+        point_ids, entry_ids = point_ids[contained], entry_ids[contained]
+        found = np.zeros(len(points), dtype=np.int64)
+        # a few ZCTAs overlap a bit: a point in more than one gets the one listed first in the file
+        order = np.lexsort((self.polygon_positions[entry_ids], point_ids))
+        point_ids, entry_ids = point_ids[order], entry_ids[order]
+        first = np.ones(len(point_ids), dtype=bool)
+        first[1:] = point_ids[1:] != point_ids[:-1]
+        found[point_ids[first]] = self.polygon_zips[entry_ids[first]]
+        return found
+
+    def lookup(self, longitudes, latitudes)->np.ndarray:
+        """
+        This function takes two inputs:
+        longitudes: a list, array or Series of longitudes.
+        latitudes: a list, array or Series of latitudes, in the same order.
 
-def clean_store_ahs_data(import_name: str, savefile_name: str):
+        Returns the ZCTA of every point, or 0 for points outside every ZCTA
+        (or without coordinates).
+        """
+        points = np.column_stack([np.asarray(longitudes, dtype=float),
+                                  np.asarray(latitudes, dtype=float)])
+        return np.concatenate([np.zeros(0, dtype=np.int64)] +
+                              [self.query_chunk(points[start:start + ZCTA_JOIN_CHUNK_SIZE])
+                               for start in range(0, len(points), ZCTA_JOIN_CHUNK_SIZE)])
+
+@functools.lru_cache(maxsize=None)
+def load_zcta_index(geojson_name: str = "nyc-zip-code-tabulation-areas-polygons.geojson")\
+        ->ZctaIndex:
     """
-    Step 1: clean up the Affordable Housing data and save it to a csv file.
+    This function takes one input:
+    geojson_name: the name of a .geojson file of NYC ZIP code tabulation areas.
 
-    This function takes two inputs:
-    import_name: name of a Affordable Housing .csv file to import data from.
-    savefile_name: name of a .csv file to save cleaned data to.
+    The file is only read the first time a given geojson_name is asked for;
+    later calls return the same ZctaIndex.
 
-    This function imports the given Affordable Housing data set, processes its contents,
-    and saves it to another filename. Most of the actual work occurs in import_housing.
-    """
-    print("Beginning step 1: importing Affordable Housing data")
-    desired_columns = [ "Project ID", "Project Start Date", "Project Completion Date",\
-                        "Borough", "Postcode", "Census Tract",\
-                        "NTA - Neighborhood Tabulation Area",\
-                        "Building Completion Date", "Reporting Construction Type",\
-                        "Extended Affordability Only", "Extremely Low Income Units",\
-                        "Very Low Income Units", "Low Income Units", "Moderate Income Units",\
-                        "Middle Income Units", "All Counted Units", "Total Units"]
-    # print("Before import")
-    # print(desired_columns)
-    df_housing = import_housing(import_name, desired_columns)
-
-    # saving intermediate work to .csv files
-    # to skip earlier work in later sections
-    df_housing.to_csv(savefile_name, index=False)
-
-    # df_housing = pd.read_csv("AHP_by_Building_cleaned.csv")
-    # print(df_housing)
-
-def strip_letters(index: str)->str:
+    Returns a ZctaIndex of the file's polygons.
     """
-    This function takes one input:
-    index: a string containing a zip code.
+    with open(geojson_name, mode="r", encoding="utf_8") as zips:
+        return ZctaIndex(geojson.load(zips))
 
-    Returns the zip code without the extra letters.
+# Default date used for projects without a start or completion date.
+DEFAULT_PROJECT_DATE = "01/01/2024"
 
-    Example:
-    input: 'ZCTA5 10101 Estimate'
-    Returns: '10101'
+def round_series(series: pd.Series, places: int)->pd.Series:
     """
-    output = ""
-    for char in index:
-        if "0" <= char <= "9":
-            output += char
-    # Removes the stray 5 that slips into output
-    return output[1:]
+    This function takes two inputs:
+    series: a Series of floats.
+    places: number of places after the decimal to round to.
 
-def strip_punctuation(value: str)->str:
+    Returns the Series rounded exactly like round() would round each element.
+    Series.round() scales by 10**places first, which can flip values sitting on a
+    half (e.g. 129/240 = 0.5375), so those few values are rounded with round() instead.
     """
-    This function takes one input:
-    value: a string containing a percentage value from a DataFrame
+    rounded = series.round(places)
+    scaled = series * 10**places
+    near_half = (abs(scaled - np.floor(scaled) - 0.5) < 1e-6).fillna(False)
+    if near_half.any():
+        rounded[near_half] = series[near_half].apply(lambda value: round(value, places))
+    return rounded
+
+@traced
+def impute_housing(df: pd.DataFrame,
+                   zip_index: ZipIndex = None,
+                   zcta_index: ZctaIndex = None)->pd.DataFrame:
+    """
+    This function takes three inputs:
+    df: a DataFrame object containing Affordable Housing Unit data.
+    zip_index: a ZipIndex to get the default post-codes from (loaded if not given).
+    zcta_index: a ZctaIndex to place buildings with (loaded if needed and not given).
 
-    Returns a version of value without any percent signs.
+    Missing values in the following columns are replaced with the following default values:
+    Project Completion Date: January 1, 2024
+    Unit counts: 0 (after Percent is worked out, so Percent stays missing)
+    Postcode: the ZCTA the building's Latitude/Longitude falls in. Buildings without
+    coordinates (or outside every ZCTA) get the default post-code of their borough.
 
-    Example:
-    input: '22.5%'
-    Returns: '22.5'
-    """
-    if pd.isna(value) or not isinstance(value, str):
-        return value
-    output = ""
+    The following columns will be added to the DataFrame:
+    Project Start Year: year project starts
+    Project End Year: year project ends
+    Percent: All Counted Units / Total Units
 
-    for char in value:
-        if ("0" <= char <= "9") or char == ".":
-            output += char
+    Every column is then given its compact dtype (see HOUSING_SCHEMA).
 
-    if output == "":
-        output = "0"
-    return output
+    Every column is imputed as a whole (no per-row Python calls),
+    so this scales to building tables with millions of rows.
 
-def strip_quotations(column: str)->str:
+    Returns the imputed DataFrame.
     """
-    This function takes one input:
-    column: a column name from a DataFrame
+    # the AHP dates are all written as MM/DD/YYYY, so they can be parsed in bulk
+    for date_col in ["Project Completion Date", "Project Start Date"]:
+        df[date_col] = pd.to_datetime(df[date_col].fillna(DEFAULT_PROJECT_DATE),
+                                      format="%m/%d/%Y")
+
+    if set(HOUSING_COORDINATE_COLUMNS) <= set(df.columns):
+        located = df["Postcode"].isna() & df["Latitude"].notna() & df["Longitude"].notna()
+        if located.any():
+            if zcta_index is None:
+                zcta_index = load_zcta_index()
+            zctas = zcta_index.lookup(df.loc[located, "Longitude"], df.loc[located, "Latitude"])
+            # 0 is outside every ZCTA, those are left to the borough defaults
+            df.loc[located, "Postcode"] = np.where(zctas > 0, zctas, np.nan)
+    if zip_index is None:
+        zip_index = load_zip_index()
+    df["Postcode"] = df["Postcode"].fillna(zip_index.default_zips(df["Borough"]))
+
+    df["Project Start Year"] = df["Project Start Date"].dt.year
+    df["Project End Year"] = df["Project Completion Date"].dt.year
 
-    Returns a version of column without quotations.
+    # 3 places after the decimal should be enough precision here
+    df["Percent"] = round_series(df["All Counted Units"].astype(float) /
+                                 df["Total Units"].astype(float), 3)
+    # blank unit counts have always been left out of the sums, so they count as no units
+    count_columns = [col for col in HOUSING_COUNT_COLUMNS if col in df.columns]
+    df[count_columns] = df[count_columns].fillna(0)
+    return apply_schema(df, HOUSING_SCHEMA)
+
+def benchmark_impute_housing(csv_name: str, sizes: list)->pd.DataFrame:
     """
-    if pd.isna(column) or not isinstance(column, str):
-        return column
-    output = ""
+    This function takes two inputs:
+    csv_name: the name of an Affordable Housing in NYC .csv file to sample buildings from.
+    sizes: a list of building counts to time impute_housing() at.
 
-    for char in column:
-        if char != "\"":
-            output += char
-    return output
+    The buildings in the .csv file are resampled (with replacement) up to each size
+    and then imputed, so the timings show how step 1 scales past the sample data set.
 
+    Returns a DataFrame of building counts, seconds taken and buildings per second.
+    """
+    df_sample = pd.read_csv(csv_name)
+    results = []
+    for size in sizes:
+        df = df_sample.sample(n=size, replace=True, random_state=size)\
+                      .reset_index(drop=True)
+        start = time.perf_counter()
+        impute_housing(df)
+        elapsed = time.perf_counter() - start
+        print(f"Imputed {size} buildings in {elapsed:.3f} seconds")
+        results.append([size, elapsed, size / elapsed])
+    return pd.DataFrame(results, columns=["Buildings", "Seconds", "Buildings per Second"])
+
+# Rows of Affordable Housing data cleaned at a time by "python main_project.py stream".
+HOUSING_CHUNK_SIZE = 100000
+
+# Columns of the Affordable Housing data kept by Step 1.
+HOUSING_COLUMNS = ["Project ID", "Project Start Date", "Project Completion Date",\
+                   "Borough", "Postcode", "Census Tract",\
+                   "NTA - Neighborhood Tabulation Area",\
+                   "Building Completion Date", "Reporting Construction Type",\
+                   "Extended Affordability Only", "Extremely Low Income Units",\
+                   "Very Low Income Units", "Low Income Units", "Moderate Income Units",\
+                   "Middle Income Units", "All Counted Units", "Total Units"]
+
+# Label of the citywide column of the Income by ZIP data, stored as ZIP 10000.
+NYC_HOUSEHOLDS_LABEL = "New York city, New York!!Households!!Estimate"
+
+# Columns of the raw Income by ZIP data that hold an estimate of number of households.
+HOUSEHOLD_ESTIMATE_PATTERN = r"!!Households!!Estimate$"
+
+# Percent columns of the Income by ZIP data, rescaled to decimals between 0 and 1.
+INCOME_BRACKET_COLUMNS = ["Less than $10,000",
+                          "$10,000 to $14,999",
+                          "$15,000 to $24,999",
+                          "$25,000 to $34,999",
+                          "$35,000 to $49,999",
+                          "$50,000 to $74,999",
+                          "$75,000 to $99,999",
+                          "$100,000 to $149,999",
+                          "$150,000 to $199,999",
+                          "$200,000 or more"]
+
+# Compact dtypes of the cleaned Income by ZIP data (see apply_schema()).
+# The bracket shares only have 3 decimals, which float32 holds.
+INCOME_SCHEMA = {"Total Households": "int32",
+                 "Median income (dollars)": "int32",
+                 "Mean income (dollars)": "int32",
+                 **{col: "float32" for col in INCOME_BRACKET_COLUMNS},
+                 "Household income in the past 12 months": "float32"}
+# Compact dtypes of the expanded Income by ZIP data, on top of INCOME_SCHEMA.
+# The H/H ratios stay float64 since the models are fitted on them.
+EXPANDED_SCHEMA = {**INCOME_SCHEMA,
+                   "Zipcode": "int32",
+                   "Total Affordable Housing": "int32",
+                   **{f"{band} Income Households": "int32"
+                      for band in ["Extremely Low", "Very Low", "Low", "Moderate", "Middle"]},
+                   **{f"{band} Housing": "int32"
+                      for band in ["Extremely Low", "Very Low", "Low", "Moderate", "Middle"]},
+                   "Borough": "category"}
+
+@traced
 def impute_income(df: pd.DataFrame, year: int)->pd.DataFrame:
     """
     This function takes two inputs:
-    df: a DataFrame object containing Income by ZIP code data.
+    df: a DataFrame object containing raw Income by ZIP code data, as laid out by the
+    Census: one row per statistic and one column per area and household type.
     year: the year the data corresponds to.
 
     The DataFrame undergoes the following changes:
-    - Remove all columns that isn't an estimate of number of households
-    - Rename columns to a more readable format
-    - Drop some columns that contain no useful data
+    - Keep only the columns that are an estimate of number of households
+    - Turn the area labels into zip codes (e.g. 'ZCTA5 10101!!Households!!Estimate' -> '10101')
+    - Turn every area into a row and every statistic into a column
+    - Rename statistics to a more readable format
+    - Drop some statistics that contain no useful data
     - Set index name to "Zipcode"
-    - Convert columns with dtype "object" to "int" or "float" when appropriate
+    - Convert values to "int" or "float" (e.g. '22.5%' -> 22.5, '2,500-' -> 2500)
     - Discard rows with a "Total" value of 0
+    - Give every column its compact dtype (see INCOME_SCHEMA)
+
+    All of the string cleanup is done with vectorized string methods on whole columns,
+    and the values of every area are cleaned in one block, so the time taken grows with the
+    number of areas instead of the number of characters handled one at a time in Python.
 
     Returns the imputed DataFrame.
     """
-    # drop undesired columns
-    drop_idx_list = []
-    for idx in df.index:
-        if "!!Households!!" not in idx:
-            drop_idx_list.append(idx)
-    df.drop(index=drop_idx_list, inplace=True)
-
-    # rename indices
-    rename_index_dict = {}
-    for idx in df.index:
-        if idx == "New York city, New York!!Households!!Estimate":
-            rename_index_dict[idx] = "10000"
-        else:
-            rename_index_dict[idx] = strip_letters(idx)
-    df.rename(index=rename_index_dict, inplace=True)
+    # keep the household estimates only
+    df = df.loc[:, df.columns.str.contains(HOUSEHOLD_ESTIMATE_PATTERN, regex=True)]
 
-    # rename columns
-    rename_column_dict = {}
-    for col in df.columns:
-        rename_column_dict[col] = strip_quotations(col.strip())
-    df.rename(columns=rename_column_dict, inplace=True)
+    # the zip is every digit in the label except the 5 of "ZCTA5"
+    zips = df.columns.str.replace(r"\D", "", regex=True).str[1:]
+    zips = zips.where(df.columns != NYC_HOUSEHOLDS_LABEL, "10000")
 
+    # rename statistics: drop the indenting spaces and any quotations
+    labels = df.index.str.strip().str.replace("\"", "", regex=False)
     # older versions of the income by zip files has percent imputed instead of percent allocated
-    # this is a hot-fix to deal with this without modifying other lines of code
     if year <= 2015:
-        df.rename(columns={"PERCENT IMPUTED":"PERCENT ALLOCATED"}, inplace=True)
+        labels = labels.where(labels != "PERCENT IMPUTED", "PERCENT ALLOCATED")
 
-    # drop useless columns
+    # drop useless statistics
     columns_to_drop = ["PERCENT ALLOCATED", "Family income in the past 12 months",\
                        "Nonfamily income in the past 12 months"]
-    df.drop(columns=columns_to_drop, inplace=True)
-
-    df.index.name = "Zipcode"
-
-    # convert 'object' dtypes to 'int' or 'float'
-    # also discard zips that contain no residents
-    for col in df.columns:
-        df[col] = df[col].apply(strip_punctuation)
-        df = df[df["Total"] != 0]
-
-        if col in ["Zipcode", "Total", "Median income (dollars)", "Mean income (dollars)"]:
-            df[col] = df[col].astype(int)
-        else:
-            df[col] = df[col].astype(float)
+    kept_rows = ~labels.isin(columns_to_drop)
+
+    # one row per area, one column per statistic, then every value is cleaned at once
+    # by keeping only its digits and decimal points ("-" and similar become 0)
+    values = df.to_numpy(dtype=object)[kept_rows].T
+    numbers = pd.Series(values.ravel()).str.replace(r"[^0-9.]", "", regex=True)\
+                                       .replace("", "0").astype(float)
+    df = pd.DataFrame(numbers.to_numpy().reshape(values.shape),
+                      index=pd.Index(zips, name="Zipcode"),
+                      columns=labels[kept_rows])
+
+    # discard zips that contain no residents
+    df = df[df["Total"] != 0]
+    df = df.astype({col: int for col in ["Total",
+                                         "Median income (dollars)",
+                                         "Mean income (dollars)"]})
 
     # a more descriptive column name
-    df.rename(columns={"Total": "Total Households"}, inplace=True)
+    df = df.rename(columns={"Total": "Total Households"})
 
     # turning the percent columns into easier to work with decimals between 0 and 1
-    rescale_column_list = ["Less than $10,000",
-                           "$10,000 to $14,999",
-                           "$15,000 to $24,999",
-                           "$25,000 to $34,999",
-                           "$35,000 to $49,999",
-                           "$50,000 to $74,999",
-                           "$75,000 to $99,999",
-                           "$100,000 to $149,999",
-                           "$150,000 to $199,999",
-                           "$200,000 or more"]
-    for col in rescale_column_list:
-        df[col] = df[col].apply(lambda percent: round(percent/100, 3))
-
-    return df[df["Total Households"] != 0]
+    for col in INCOME_BRACKET_COLUMNS:
+        df[col] = round_series(df[col] / 100, 3)
+
+    return apply_schema(df[df["Total Households"] != 0], INCOME_SCHEMA)
 
+@traced
 def import_income(csv_name: str, year: int)->pd.DataFrame:
     """
     This function takes two inputs:
     csv_name: the name of an Income by ZIP .csv file to read.
     year: the year the file's data corresponds to.
 
-    The data in the .csv file is read into a DataFrame and then transposed.
+    The .csv file has a handful of rows (one per statistic) and one column per area and
+    household type, so it is parsed straight into a single block of strings instead of
+    building one pandas column per area. Only the household estimate columns are kept.
     The DataFrame is then passed to impute_income().
 
-    Returns an imputed version of the modified DataFrame.
+    Returns an imputed version of the DataFrame.
     """
-    df_zip_income = pd.read_csv(csv_name, index_col=[0])
-    #print(df_zip_income)
-    # for column_label in df_zip_income:
-    #     print("Printing a column label")
-    #     print(column_label)
-    df_zip_income = df_zip_income.transpose()
-    #print(df_zip_income)
-
+    with open(csv_name, mode="r", encoding="utf_8_sig", newline="") as income_file:
+        reader = csv.reader(income_file)
+        header = next(reader)
+        rows = list(reader)
+    columns = pd.Index(header[1:])
+    kept_columns = columns.str.contains(HOUSEHOLD_ESTIMATE_PATTERN, regex=True)
+    values = np.array([row[1:] for row in rows], dtype=object)[:, kept_columns]
+    # empty cells are missing values, like read_csv() would have them
+    values[values == ""] = np.nan
+    df_zip_income = pd.DataFrame(values,
+                                 index=pd.Index([row[0] for row in rows], name=header[0]),
+                                 columns=columns[kept_columns])
     return impute_income(df_zip_income, year)
 
-def clean_store_income_data(import_name: str, savefile_name: str, year: int):
-    """
-    Step 2: clean up the 2021 Income by ZIP data and save it to a csv file.
+# Affordable housing unit columns that get summed up per ZIP in Step 3.
+HOUSING_UNIT_COLUMNS = ["All Counted Units",
+                        "Extremely Low Income Units",
+                        "Very Low Income Units",
+                        "Low Income Units",
+                        "Moderate Income Units",
+                        "Middle Income Units"]
 
-    This function takes in three inputs:
-    import_name: the name of an Income by ZIP .csv file to read from.
-    savefile_name: the name of a .csv file to save cleaned income data to.
-    year: the year the Income by ZIP data corresponds to.
+class HousingTotals:
+    """
+    The affordable housing unit sums of every zip, for every completion year cutoff.
 
-    This function is sort of a wrapper function for import_income().
+    The units are added up once per (Postcode, Project End Year) bucket and then summed
+    along the years, so the sums for any cutoff are one slice of that table instead of
+    another pass over every building. Preservation projects are kept apart and always
+    counted, since those projects must be working on existing units.
     """
-    print("Beginning Step 2: cleaning Income by ZIP data")
-    df_zip_income = import_income(import_name, year)
-    df_zip_income.to_csv(savefile_name, index=True)
+    def __init__(self, df_housing: pd.DataFrame, unit_columns: list = None):
+        """
+        This function takes two inputs:
+        df_housing: a DataFrame of cleaned Affordable Housing data (see Step 1),
+        or its housing_buckets().
+        unit_columns: names of the unit columns to add up (HOUSING_UNIT_COLUMNS if not given).
+        """
+        self.unit_columns = list(unit_columns) if unit_columns is not None \
+            else list(HOUSING_UNIT_COLUMNS)
+        self.postcodes, zip_codes = np.unique(df_housing["Postcode"].to_numpy(),
+                                              return_inverse=True)
+        years = df_housing["Project End Year"].to_numpy(dtype=np.int64)
+        preserved = (df_housing["Reporting Construction Type"] == "Preservation").to_numpy()
+        num_zips = len(self.postcodes)
+
+        # the year buckets only cover the years of the projects that are not preservation
+        built_years = years[~preserved]
+        self.first_year = int(built_years.min()) if len(built_years) else 0
+        num_years = int(built_years.max()) - self.first_year + 1 if len(built_years) else 0
+        buckets = zip_codes[~preserved] * num_years + (built_years - self.first_year)
+
+        # zip x year x unit column, summed along the years
+        by_year = np.stack([np.bincount(buckets, weights=df_housing[col].to_numpy()[~preserved],
+                                        minlength=num_zips * num_years)
+                            for col in self.unit_columns], axis=1)
+        # the shape is spelled out since either count can be 0 (no projects that
+        # are not preservation, or no buildings at all)
+        self.cumulative = by_year.reshape(num_zips, num_years, len(self.unit_columns))\
+                                 .cumsum(axis=1).astype(np.int64)
+        # zip x unit column
+        self.preserved = np.stack([np.bincount(zip_codes[preserved],
+                                               weights=df_housing[col].to_numpy()[preserved],
+                                               minlength=num_zips)
+                                   for col in self.unit_columns], axis=1).astype(np.int64)
+
+    def sums(self, year: int)->np.ndarray:
+        """
+        This function takes one input:
+        year: a cutoff that drops all non-preservation projects completed after it.
+
+        Returns a zip x unit column array of unit sums, in the order of self.postcodes.
+        """
+        position = min(year - self.first_year, self.cumulative.shape[1] - 1)
+        if position < 0:
+            return self.preserved.copy()
+        return self.cumulative[:, position] + self.preserved
 
-def add_data_to_income(import_name: str, savefile_name: str, year: int):
+    def totals(self, year: int)->pd.DataFrame:
+        """
+        This function takes one input:
+        year: a cutoff that drops all non-preservation projects completed after it.
+
+        Returns one row of unit sums per Postcode for the buildings that count at this cutoff,
+        and the citywide totals in the row for ZIP 10000, matching the "New York city" row
+        of the Income by ZIP data.
+        """
+        sums = self.sums(year)
+        df_sums = pd.DataFrame(sums, columns=self.unit_columns,
+                               index=pd.Index(self.postcodes, name="Postcode"))
+        df_sums.loc[10000] = sums.sum(axis=0)
+        return df_sums
+
+# Columns the buildings are bucketed by in housing_buckets(): every rollup key,
+# the completion year and the construction type (to keep preservation projects apart).
+HOUSING_BUCKET_COLUMNS = ["Borough", "NTA - Neighborhood Tabulation Area", "Census Tract",
+                          "Postcode", "Project End Year", "Reporting Construction Type"]
+
+@traced
+def housing_buckets(df_housing: pd.DataFrame)->pd.DataFrame:
     """
-    Step 3: add to the Income by ZIP csv columns of possibly useful data.
+    This function takes one input:
+    df_housing: a DataFrame of cleaned Affordable Housing data (see Step 1),
+    or of buckets made by this function.
 
-    This function takes three inputs:
-    import_name: the name of a Income by ZIP csv file to read from.
-    savefile_name: the name of a csv file to save modified Income by ZIP data to.
-    year: a cutoff that tells the code to drop all rows with completion years after it.
+    Adds up the buildings of every combination of HOUSING_BUCKET_COLUMNS: every unit count
+    is summed and the number of buildings is kept in "Buildings". HousingTotals and
+    rollup_housing() give the same totals for the buckets as for the buildings themselves,
+    and buckets of buckets are the same buckets, so chunks of buildings can be bucketed
+    one at a time and then merged.
 
-    The data produced by Steps 1 and 2 are loaded into DataFrames.
+    Returns a DataFrame with one row per bucket.
+    """
+    if "Buildings" not in df_housing.columns:
+        df_housing = df_housing.assign(Buildings=1)
+    count_columns = ["Buildings"] + [col for col in HOUSING_COUNT_COLUMNS
+                                     if col in df_housing.columns]
+    return df_housing.groupby(HOUSING_BUCKET_COLUMNS, observed=True, dropna=False, sort=False)\
+                     [count_columns].sum().reset_index()
+
+# Geographic levels that rollup_housing() adds the units up at, and the building columns
+# that key each level. Census tract numbers repeat across boroughs, so a tract is keyed by both.
+ROLLUP_GROUPING_SETS = {"City": [],
+                        "Borough": ["Borough"],
+                        "NTA": ["NTA - Neighborhood Tabulation Area"],
+                        "Census Tract": ["Borough", "Census Tract"],
+                        "Postcode": ["Postcode"]}
+# Buildings without a value for a rollup key column are counted under this key.
+ROLLUP_MISSING_KEY = "Unknown"
+
+@traced
+def rollup_housing(df_housing: pd.DataFrame,
+                   years: list = None,
+                   grouping_sets: dict = None,
+                   unit_columns: list = None)->pd.DataFrame:
+    """
+    This function takes four inputs:
+    df_housing: a DataFrame of cleaned Affordable Housing data (see Step 1),
+    or its housing_buckets().
+    years: completion year cutoffs to add the units up for (see HousingTotals),
+    or None to count every building.
+    grouping_sets: a dict of level names and the columns that key each level
+    (ROLLUP_GROUPING_SETS if not given). A level with no columns is the whole city.
+    unit_columns: names of the unit columns to add up
+    (HOUSING_UNIT_COLUMNS and "Total Units" if not given).
+
+    The buildings are only gone over once: their units are summed per combination of
+    every key column (and completion year), and each level is then added up from those
+    few combinations, the way SQL's GROUPING SETS does it.
+
+    Returns one row per level and key (and year cutoff) with the number of buildings,
+    the unit sums and "Percent", the share of the total units that are counted.
+    Key columns that are not part of a row's level are left empty.
+    """
+    if grouping_sets is None:
+        grouping_sets = ROLLUP_GROUPING_SETS
+    if unit_columns is None:
+        unit_columns = HOUSING_UNIT_COLUMNS + ["Total Units"]
+    key_columns = list(dict.fromkeys(col for cols in grouping_sets.values() for col in cols))
+
+    # every key column as ints, with 0 standing for a missing value. the keys are sorted,
+    # so the rows come out in the same order whatever order the buildings are in
+    key_codes = []
+    key_labels = {}
+    for col in key_columns:
+        codes, uniques = pd.factorize(df_housing[col], sort=True)
+        key_codes.append(codes + 1)
+        key_labels[col] = np.concatenate([[ROLLUP_MISSING_KEY], np.asarray(uniques, dtype=object)])
+    # preservation projects are always counted, so they go in a year bucket before every year
+    end_years = df_housing["Project End Year"].to_numpy(dtype=np.int64)
+    first_year = int(end_years.min()) - 1 if len(end_years) else 0
+    preserved = (df_housing["Reporting Construction Type"] == "Preservation").to_numpy()
+    year_codes = np.where(preserved, 0, end_years - first_year)
+
+    # the one pass over the buildings: sums per combination of key columns and year
+    shape = [len(key_labels[col]) for col in key_columns] + [int(year_codes.max(initial=0)) + 1]
+    combos, combo_ids = np.unique(np.ravel_multi_index(key_codes + [year_codes], shape),
+                                  return_inverse=True)
+    # buckets of buildings (see housing_buckets()) carry their number of buildings
+    buildings = df_housing["Buildings"].to_numpy() if "Buildings" in df_housing.columns \
+        else None
+    combo_sums = np.column_stack([np.bincount(combo_ids, weights=buildings,
+                                              minlength=len(combos))] +
+                                 [np.bincount(combo_ids, weights=df_housing[col].to_numpy(),
+                                              minlength=len(combos))
+                                  for col in unit_columns]).astype(np.int64)
+    combo_keys = dict(zip(key_columns + ["Year"], np.unravel_index(combos, shape)))
+
+    df_levels = []
+    for year in (years if years is not None else [None]):
+        counted = np.ones(len(combos), dtype=bool) if year is None \
+            else (combo_keys["Year"] == 0) | (combo_keys["Year"] <= year - first_year)
+        for level, cols in grouping_sets.items():
+            if cols:
+                level_keys, level_ids = np.unique(
+                    np.ravel_multi_index([combo_keys[col][counted] for col in cols],
+                                         [len(key_labels[col]) for col in cols]),
+                    return_inverse=True)
+                level_codes = np.unravel_index(level_keys, [len(key_labels[col]) for col in cols])
+            else:
+                level_ids = np.zeros(counted.sum(), dtype=np.int64)
+                level_codes = [np.zeros(1, dtype=np.int64)]
+            sums = np.stack([np.bincount(level_ids, weights=combo_sums[counted, position],
+                                         minlength=len(level_codes[0]))
+                             for position in range(combo_sums.shape[1])], axis=1)
+            df_level = pd.DataFrame(sums.astype(np.int64),
+                                    columns=["Buildings"] + list(unit_columns))
+            for col, codes in zip(cols, level_codes):
+                df_level[col] = key_labels[col][codes]
+            df_level.insert(0, "Level", level)
+            if year is not None:
+                df_level.insert(0, "Year", year)
+            df_levels.append(df_level)
+
+    df_rollup = pd.concat(df_levels, ignore_index=True)
+    # every key column comes right after Level, whether or not a level uses it
+    leading_columns = ["Year", "Level"] if years is not None else ["Level"]
+    df_rollup = df_rollup[leading_columns + key_columns + ["Buildings"] + list(unit_columns)]
+    if "All Counted Units" in unit_columns and "Total Units" in unit_columns:
+        df_rollup["Percent"] = round_series(df_rollup["All Counted Units"] /
+                                            df_rollup["Total Units"], 3)
+    return df_rollup
+
+# Upper income limit of each AMI band, as a multiple of a zip's median income.
+PERCENT_INCOME_DICT = {"Extremely Low Income Units":0.3,
+                       "Very Low Income Units":0.5,
+                       "Low Income Units":0.8,
+                       "Moderate Income Units":1.2,
+                       "Middle Income Units":1.65}
+
+# Upper income limit of each Income by ZIP household bracket.
+MAX_INCOME_DICT = {"Less than $10,000":10000,
+                   "$10,000 to $14,999":15000,
+                   "$15,000 to $24,999":25000,
+                   "$25,000 to $34,999":35000,
+                   "$35,000 to $49,999":50000,
+                   "$50,000 to $74,999":75000,
+                   "$75,000 to $99,999":100000,
+                   "$100,000 to $149,999":150000,
+                   "$150,000 to $199,999":200000,
+                   "$200,000 or more":500000}
+
+@traced
+def estimate_band_households(df_zip_income: pd.DataFrame)->pd.DataFrame:
+    """
+    This function takes one input:
+    df_zip_income: a DataFrame of cleaned Income by ZIP data (see Step 2).
+
+    This function derives an approximate number for the number of households that fall
+    into each of the % based income brackets (AMI bands) in the AHP csv.
+
+    The math goes as follows, for every zip and every band at once:
+    - Multiply the zip's median by the band's percent value to get an
+    `upper raw income limit` for that band for that zip.
+        - Example: "Extremely Low Income Units" has a percent value of 0.3.
+    - Go through each raw income bracket from lowest to highest, using its `max income`.
+        - Example: "$10000 to $14999" has a max of 15000.
+        - If it fully falls under limit: count the entire bracket population.
+        - If it partially falls under limit: count household count * (`raw limit` / `max income`).
+        - All brackets after the first partial one are not counted.
+    - Every count is truncated to an int before being added up.
+    - Sum the counts, which over-counts every band by the households of the band below it,
+    then subtract the band below to get the households that fall into each band only.
+
+    The shares and totals are stored as a ZIP x bracket matrix and the income limits
+    as a ZIP x band matrix, so all five bands are computed with array operations.
+
+    Returns a DataFrame with one "... Income Households" column per band,
+    in the same row order as df_zip_income.
+    """
+    # the shares are stored as float32, rounding them back to their 3 decimals
+    # gives the exact float64 shares the counts have always been computed with
+    shares = np.round(df_zip_income[list(MAX_INCOME_DICT)].to_numpy(dtype=float), 3)
+    max_incomes = np.array(list(MAX_INCOME_DICT.values()))
+    total_households = df_zip_income["Total Households"].to_numpy()
+    medians = df_zip_income["Median income (dollars)"].to_numpy()
+
+    # ZIP x band
+    upper_raw_incomes = medians[:, None] * np.array(list(PERCENT_INCOME_DICT.values()))[None, :]
+    # ZIP x band x bracket: brackets fully under the limit always form a prefix
+    # since the max incomes are in ascending order
+    fully_under = max_incomes[None, None, :] < upper_raw_incomes[:, :, None]
+    previous_fully_under = np.concatenate(
+        [np.ones_like(fully_under[:, :, :1]), fully_under[:, :, :-1]], axis=2)
+    partially_under = ~fully_under & previous_fully_under
+
+    full_counts = np.trunc(shares * total_households[:, None])[:, None, :]
+    portions = total_households[:, None, None] * \
+        (upper_raw_incomes[:, :, None] / max_incomes[None, None, :])
+    partial_counts = np.trunc(shares[:, None, :] * portions)
+    counts = np.where(fully_under, full_counts, 0.0) + \
+        np.where(partially_under, partial_counts, 0.0)
+    band_households = counts.sum(axis=2).astype(np.int64)
+
+    # every band but the lowest over-counts the households of the band below it
+    band_households[:, 1:] -= band_households[:, :-1].copy()
+
+    band_names = [unit_name.replace("Units", "Households") for unit_name in PERCENT_INCOME_DICT]
+    return pd.DataFrame(band_households, columns=band_names, index=df_zip_income.index)
+
+@traced
+def expand_income(df_zip_income: pd.DataFrame,
+                  df_housing,
+                  year: int,
+                  zip_index: ZipIndex = None)->pd.DataFrame:
+    """
+    This function takes four inputs:
+    df_zip_income: a DataFrame of cleaned Income by ZIP data (see Step 2).
+    df_housing: a DataFrame of cleaned Affordable Housing data (see Step 1),
+    or the HousingTotals built from it when several years are expanded.
+    year: a cutoff that tells the code to drop all rows with completion years after it.
+    zip_index: a ZipIndex to get boroughs from (loaded if not given).
 
     The Income by ZIP DataFrame gains the following columns:
     - Total Affordable Housing: number of affordable housing units present in each zip code.
@@ -357,148 +1199,36 @@ def add_data_to_income(import_name: str, savefile_name: str, year: int):
     housing designated for their bracket, assuming a fair assignment of housing to households
     - Borough: the borough for a given zip code.
 
-    The DataFrame is then saved to a new .csv file.
+    Every column is then given its compact dtype (see EXPANDED_SCHEMA).
+
+    Returns the expanded DataFrame.
     """
-    print("Beginning Step 3: adding data to Income by ZIP data")
-    df_zip_income = pd.read_csv(import_name)
-    # hard-coded affordable housing csv name, because I am only working with one such data set.
-    df_housing = pd.read_csv("AHP_by_Building_cleaned.csv")
+    # straight out of import_income() the zips are the (string) index instead of a column
+    if "Zipcode" not in df_zip_income.columns:
+        df_zip_income = df_zip_income.reset_index()
+    df_zip_income = df_zip_income.astype({"Zipcode": int})
     # same thing with zips and boros
-    df_zips_boros = pd.read_csv("nyc_zipcodes_and_boros.csv")
-    df_zips_boros.rename(columns={"ZipCode":"Zipcode"}, inplace=True)
-
-    # this line filters out housing projects not complete after the specified year
-    # but keeps preservation projects since those projects must be working on existing units
-    df_housing = df_housing[(df_housing["Project End Year"] <= year) |
-                            (df_housing["Reporting Construction Type"] == "Preservation")]
-
-    def extract_boro(zipcode: int)->str:
-        """
-        This function takes one input:
-        zipcode: a zip code.
-    
-        Returns a boro given a zipcode.
-        Self note: Had to manually add a couple of zipcodes to nyc_zips_and_boros.csv.
-        """
-        #print("Zipcode is: ", zipcode)
-        if zipcode == 10000:
-            return "New York"
-        output_zip = df_zips_boros[df_zips_boros["Zipcode"]==zipcode]["Borough"]
-        if output_zip.empty:
-            return "Other"
-        #print(output_zip)
-        # output_zip is a series containing 1 thing
-        # iloc[0] returns the only thing stored inside (the borough value)
-        return output_zip.iloc[0]
-
-    def extract_housing_sum(zipcode: int, unit_type: str)->int:
-        """
-        This function takes two inputs:
-        zipcode: a zip code.
-        unit_type: name of a DataFrame column corresponding to a type of affordable housing.
-
-        An internal function to do some math.\n
-        This workaround avoids a "Can only compare identically labeled Series objects"
-        value error that appears if you try to run the commented out code.
-
-        I chose to define this function inside of add_data_to_income() because
-        this function needs access to df_housing and I would much rather not pass
-        df_housing to it every time it gets called (and take up unnecessary memory).
-        """
-        if zipcode == 10000:
-            return df_housing[unit_type].sum()
-        return df_housing[df_housing["Postcode"] == zipcode][unit_type].sum()
-
-    def convert_percent_to_raw(zipcode: int, percent_bracket_name: str)->int:
-        """
-        This function takes two inputs:
-        zipcode: a zip code.
-        percent_bracket_name: DataFrame column name corresponding to a type of affordable housing.
-
-        Another internal function.
-        This function hopes to derive an approximate number for the number of people who fall
-        into one of the % based income brackets in the AHP csv.
-
-        The math goes as follows:
-        - Take in a zipcode and the name of a percent income bracket.
-        - Identify that zip's median and the percent value correlating to the bracket name.
-            - Example: "Extremely Low Income Units" will return a value of 0.3.
-        - Multiply the two to get an `upper raw income limit` for that percent bracket for that zip.
-        - Iterate through each raw income bracket for that zip from lowest to highest.
-        - For each column, derive the `max income` of its bracket.
-            - Example: "$10000 to $14999" will return a max of 15000.
-        - See if the raw income bracket partially or fully falls below `upper raw income limit`.
-            - If it fully falls under limit: += the entire bracket population to an output value.
-            - If it partially falls under limit: += household count * (`raw limit` / `max income`).
-            - End the loop by then, since all remaining brackets will not fall under the limit.
-        - Return the output value.
-
-        Example: given a ZIP of 12345 and a percent bracket of "Low Income Units",
-        return a value that denotes "this many people in this zip qualify for Low Income category".
-        """
-        percent_income_dict = {"Extremely Low Income Units":0.3,
-                               "Very Low Income Units":0.5,
-                               "Low Income Units":0.8,
-                               "Moderate Income Units":1.2,
-                               "Middle Income Units":1.65}
-        max_income_dict = {"Less than $10,000":10000,
-                            "$10,000 to $14,999":15000,
-                            "$15,000 to $24,999":25000,
-                            "$25,000 to $34,999":35000,
-                            "$35,000 to $49,999":50000,
-                            "$50,000 to $74,999":75000,
-                            "$75,000 to $99,999":100000,
-                            "$100,000 to $149,999":150000,
-                            "$150,000 to $199,999":200000,
-                            "$200,000 or more":500000}
-        # Chain indexing returns a Series of 1 thing, so the iloc is necessary
-        median = (df_zip_income[df_zip_income["Zipcode"] == zipcode]\
-                  ["Median income (dollars)"]).iloc[0]
-        percent_multiplier = percent_income_dict[percent_bracket_name]
-        upper_raw_income = median * percent_multiplier
-        output = 0
-        total_households = (df_zip_income[df_zip_income["Zipcode"] == zipcode]\
-                            ["Total Households"]).iloc[0]
-
-        # This system is imperfect as it over-counts people from lower brackets.
-        # This will be fixed outside this inner function.
-        for col in max_income_dict.items():
-            household_percent = df_zip_income[df_zip_income["Zipcode"] == zipcode][col[0]].iloc[0]
-            if col[1] < upper_raw_income:
-                output += int(household_percent * total_households)
-            else:
-                portion = total_households * (upper_raw_income / col[1])
-                output += int(household_percent * portion)
-                break
-        return output
+    if zip_index is None:
+        zip_index = load_zip_index("nyc_zipcodes_and_boros.csv")
 
-    # ============================================================================================
-    # Helpers end here, actual coding begins here
+    # housing projects not complete after the specified year are left out,
+    # but preservation projects are always counted (see HousingTotals)
+    if not isinstance(df_housing, HousingTotals):
+        df_housing = HousingTotals(df_housing)
+    # one row of unit sums per zip, reindexed to line up with the Income by ZIP rows
+    # zips without any affordable housing get sums of 0
+    df_housing_sums = df_housing.totals(year).reindex(df_zip_income["Zipcode"], fill_value=0)
 
     df_zip_income["Total Affordable Housing"] = \
-        df_zip_income["Zipcode"].apply\
-            (lambda zipcode: extract_housing_sum(zipcode,"All Counted Units"))
+        df_housing_sums["All Counted Units"].to_numpy()
     df_zip_income["Housing to Households Ratio"] =\
         df_zip_income["Total Affordable Housing"] / df_zip_income["Total Households"]
     df_zip_income["Housing to Households Ratio"] = \
         df_zip_income["Housing to Households Ratio"].apply(lambda ratio: round(ratio, 3))
 
-    new_column_names = {"Extremely Low Income Units":"Extremely Low Income Households",
-                        "Very Low Income Units":"Very Low Income Households",
-                        "Low Income Units":"Low Income Households",
-                        "Moderate Income Units":"Moderate Income Households",
-                        "Middle Income Units":"Middle Income Households"}
-    for col in new_column_names.items():
-        df_zip_income[col[1]] =\
-            df_zip_income["Zipcode"].apply\
-                (lambda zipcode: convert_percent_to_raw(zipcode,col[0]))
-
-    # convert_percent_to_raw() overcounts households for 4 of the 5 percent brackets
-    # this subtracts the over-counted households to yield more accurate household counts
-    df_zip_income["Middle Income Households"] -= df_zip_income["Moderate Income Households"]
-    df_zip_income["Moderate Income Households"] -= df_zip_income["Low Income Households"]
-    df_zip_income["Low Income Households"] -= df_zip_income["Very Low Income Households"]
-    df_zip_income["Very Low Income Households"] -= df_zip_income["Extremely Low Income Households"]
+    df_band_households = estimate_band_households(df_zip_income)
+    for col in df_band_households.columns:
+        df_zip_income[col] = df_band_households[col]
 
     # Adding columns of "total number of housing for this bracket"
     housing_column_names = {"Extremely Low Income Units":"Extremely Low Housing",
@@ -507,9 +1237,7 @@ def add_data_to_income(import_name: str, savefile_name: str, year: int):
                             "Moderate Income Units":"Moderate Housing",
                             "Middle Income Units":"Middle Housing"}
     for col in housing_column_names.items():
-        df_zip_income[col[1]] = \
-            df_zip_income["Zipcode"].apply\
-                (lambda zipcode: extract_housing_sum(zipcode, col[0]))
+        df_zip_income[col[1]] = df_housing_sums[col[0]].to_numpy()
 
     # Adding columns of "enough housing for x% of this income bracket".
     # "H/H Ratio" is short for Housing / Household Ratio.
@@ -537,106 +1265,419 @@ def add_data_to_income(import_name: str, savefile_name: str, year: int):
     df_zip_income = df_zip_income[df_zip_income["Median income (dollars)"] != 0]
     # This line removes one boro that has like 40 households residing in it and a median income of 0
     # Basically an irrelevant data point
-    df_zip_income["Borough"] = df_zip_income["Zipcode"].apply(extract_boro)
+    boroughs = zip_index.lookup(df_zip_income["Zipcode"])
+    # the boroughs are kept in the order they first show up in,
+    # which is the order the graphs color them in
+    df_zip_income["Borough"] = pd.Categorical(boroughs, categories=pd.unique(boroughs))
     #print(df_zip_income)
-    df_zip_income.to_csv(savefile_name, index=False)
+    return apply_schema(df_zip_income, EXPANDED_SCHEMA)
 
-def draw_graphs(income_csv: str, choropleth_name: str, year: int):
+def load_zcta_geojson(geojson_name: str):
     """
-    Step 4: draw graphs relevant to the project.
+    This function takes one input:
+    geojson_name: the name of a .geojson file of NYC ZIP code tabulation areas.
 
-    This function takes in 3 inputs:
-    income_csv: name of a Income by ZIP csv to read.
-    choropleth_name: name that the folium choropleth map should be saved to.
-    year: the year corresponding to the income csv, to be used in naming some things.
+    Returns the parsed geojson.
     """
-    print("Beginning Step 4: drawing graphs")
-    df_zip_income = pd.read_csv(income_csv)
+    with open(geojson_name, mode="r", encoding="utf_8") as zips:
+        return geojson.load(zips)
 
-    # scatter plot: area median income vs. Housing to Households Ratio
-    # These lines fix an issue where the NYC column has a Total Affordable Housing value of
-    # 200k and ruins the Seaborn scatterplot dot size scaling system.
-    df_zip_income_mod = df_zip_income
-    df_zip_income_mod["Total Affordable Housing"] = \
-        df_zip_income_mod["Total Affordable Housing"].apply(lambda housing: min(housing, 50000))
+# The ZCTA polygons are simplified to this tolerance (in degrees, about 10 meters)
+# and their coordinates are rounded to this many decimals (about 1 meter).
+ZCTA_SIMPLIFY_TOLERANCE = 1e-4
+ZCTA_COORDINATE_DECIMALS = 5
+# Every choropleth map loads the simplified ZCTA polygons from this one file.
+ZCTA_GEOMETRY_ASSET = "visualizations/nyc_zcta_simplified.geojson"
 
-    sns.scatterplot(
-        data=df_zip_income_mod,
-        x="Median income (dollars)",
-        y="Housing to Households Ratio",
-        hue="Borough",
-        size="Total Affordable Housing",
-        sizes=(20,200)
-    ).set(title="Housing to Household Ratios per ZIP")
-    plt.savefig(f"visualizations/NYC_Housing_to_Household_by_ZIP_{year}.png")
-    plt.show()
-    plt.clf()
+def simplify_ring(points: np.ndarray, tolerance: float)->np.ndarray:
+    """
+    This function takes two inputs:
+    points: an (n x 2) array of the coordinates of a closed polygon ring.
+    tolerance: how far (in degrees) a dropped point may be from the simplified ring.
+
+    Returns the ring simplified with the Douglas-Peucker algorithm.
+    Rings that would end up with fewer than 4 points are returned unchanged.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, len(points) - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        direction = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*direction)
+        if length == 0:
+            # the first and last points of a ring are the same point
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            segments += [(start, split), (split, end)]
+    return points[keep] if keep.sum() >= 4 else points
+
+def simplify_zcta_geojson(zips, tolerance: float = ZCTA_SIMPLIFY_TOLERANCE,
+                          decimals: int = ZCTA_COORDINATE_DECIMALS)->dict:
+    """
+    This function takes three inputs:
+    zips: a parsed geojson of NYC ZIP code tabulation areas (see load_zcta_geojson()).
+    tolerance: the tolerance polygons are simplified to (see simplify_ring()).
+    decimals: the number of decimals coordinates are rounded to.
 
-    zips = None
-    with open("nyc-zip-code-tabulation-areas-polygons.geojson",mode="r",encoding="utf_8") as zips:
-        zips = geojson.load(zips)
+    Returns a much smaller geojson of the same areas: every ZIP code's polygons are merged
+    into one MultiPolygon feature whose id is the ZIP code, only the postalCode property is
+    kept, the rings are simplified and the coordinates are rounded.
+    """
+    polygons_by_zip = {}
+    for feature in zips["features"]:
+        geometry = feature["geometry"]
+        polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" \
+            else geometry["coordinates"]
+        polygons_by_zip.setdefault(feature["properties"]["postalCode"], []).extend(polygons)
+
+    features = []
+    for postal_code, polygons in polygons_by_zip.items():
+        simplified = []
+        for polygon in polygons:
+            rings = []
+            for ring in polygon:
+                points = np.round(simplify_ring(np.asarray(ring, dtype=float), tolerance),
+                                  decimals)
+                # rounding can make neighbouring points the same point
+                distinct = np.concatenate([[True], np.any(points[1:] != points[:-1], axis=1)])
+                rings.append((points[distinct] if distinct.sum() >= 4 else points).tolist())
+            simplified.append(rings)
+        features.append({"type": "Feature",
+                         "id": postal_code,
+                         "properties": {"postalCode": postal_code},
+                         "geometry": {"type": "MultiPolygon", "coordinates": simplified}})
+    return {"type": "FeatureCollection", "features": features}
+
+@traced
+def load_simplified_zcta(geojson_name: str,
+                         tolerance: float = ZCTA_SIMPLIFY_TOLERANCE,
+                         decimals: int = ZCTA_COORDINATE_DECIMALS)->dict:
+    """
+    This function takes three inputs:
+    geojson_name: the name of a .geojson file of NYC ZIP code tabulation areas.
+    tolerance, decimals: see simplify_zcta_geojson().
 
-    def draw_choropleth(column: str, filename: str, df: pd.DataFrame)->int:
-        """
-        This function takes two inputs:
-        column: the name of a DataFrame column.
-        filename: the name of a file to save the map to.
+    Returns the simplified geojson of the file. It is cached in the artifact cache,
+    so the polygons are only simplified again when the file or the settings change.
+    """
+    key = artifact_key("zcta_simplified", [file_digest(geojson_name)],
+                       {"tolerance": tolerance, "decimals": decimals})
+    if has_artifact(key):
+        return load_artifact(key)
+    simplified = simplify_zcta_geojson(load_zcta_geojson(geojson_name), tolerance, decimals)
+    store_artifact(key, simplified)
+    return simplified
+
+def write_zcta_asset(zips: dict, asset_name: str = ZCTA_GEOMETRY_ASSET)->str:
+    """
+    This function takes two inputs:
+    zips: a simplified ZCTA geojson (see load_simplified_zcta()).
+    asset_name: the file the maps load the geometry from.
 
-        Draws a Choropleth map using the given column and stores it in the given filename.
-        """
-        choropleth_map = folium.Map(location=[40.7, -73.9])
-        folium.Choropleth(
+    Saves the geometry to asset_name, unless the file already holds exactly this geometry.
+    Returns asset_name.
+    """
+    contents = json.dumps(zips, separators=(",", ":"))
+    if os.path.exists(asset_name):
+        with open(asset_name, mode="r", encoding="utf_8") as asset:
+            if asset.read() == contents:
+                return asset_name
+    with open(asset_name, mode="w", encoding="utf_8") as asset:
+        asset.write(contents)
+    return asset_name
+
+@traced
+def draw_choropleth_layers(layers: list, filename: str, zips: dict, asset_name: str = None):
+    """
+    This function takes four inputs:
+    layers: a list of (column, DataFrame, legend name) to draw, one switchable layer each.
+    The first layer is shown when the map opens.
+    filename: the name of a file to save the map to.
+    zips: the simplified ZCTA geojson (see load_simplified_zcta()).
+    asset_name: the file zips is saved in (see write_zcta_asset()). The map loads the
+    geometry from that file instead of carrying its own copy. If not given, the geometry
+    is embedded into the map.
+
+    Draws a Choropleth map with one layer per data column and stores it in the given filename.
+    Every layer is its own FeatureGroup, so the LayerControl switches the colored zips
+    of one column on and off, while every column's legend stays on the map.
+    Maps that load a geometry file have to be opened through a web server
+    (such as the project's GitHub Pages site or python -m http.server, see the README),
+    since browsers don't let pages opened from disk (file://) load other files
+    and the map shows up blank. Leave asset_name out for a map that works from disk.
+    """
+    choropleth_map = folium.Map(location=[40.7, -73.9])
+    for layer_number, (column, df, legend_name) in enumerate(layers):
+        feature_group = folium.FeatureGroup(name=column, show=layer_number == 0)
+        choropleth = folium.Choropleth(
             geo_data=zips,
-            name="choropleth",
             data=df,
             columns=["Zipcode", column],
-            key_on="feature.properties.postalCode",
-            legend_name="Housing to Household Ratio",
+            key_on="feature.id",
+            legend_name=legend_name,
             fill_color="YlOrRd",
             fill_opacity=0.75
+        )
+        if asset_name is not None:
+            # the layer still styles every feature from zips, but fetches the shapes
+            # from the shared file (folium takes the link as is, so it is made relative
+            # to the map's folder)
+            choropleth.geojson.embed = False
+            choropleth.geojson.embed_link = \
+                os.path.relpath(asset_name, os.path.dirname(filename) or ".")
+        choropleth.geojson.add_to(feature_group)
+        if choropleth.color_scale is not None:
+            choropleth.color_scale.add_to(choropleth_map)
+        feature_group.add_to(choropleth_map)
+    folium.LayerControl().add_to(choropleth_map)
+    choropleth_map.save(filename)
+
+# Figures are drawn with this matplotlib backend in headless mode: it only draws to files,
+# so nothing opens a window or waits on plt.show().
+HEADLESS_BACKEND = "Agg"
+
+def use_headless_backend():
+    """
+    Switches matplotlib to HEADLESS_BACKEND. Also used to set up figure rendering workers.
+    """
+    matplotlib.use(HEADLESS_BACKEND)
 
-        ).add_to(choropleth_map)
-        folium.LayerControl().add_to(choropleth_map)
-        choropleth_map.save(filename)
-        return 0
-    # =======================================================
-    # based on the examples on the Folium Quick Start webpage
-    # draw_choropleth("Housing to Households Ratio", "nyc_zips_choropleth.html", df_zip_income)
-
-    # because a few outliers are making it hard to show the finer details of the other zips:
-    # a second choropleth map that excludes these outliers
-    draw_choropleth("Housing to Households Ratio", choropleth_name,\
-                    df_zip_income[df_zip_income["Housing to Households Ratio"] < 0.5])
-
-    # a choropleth on average income
-    draw_choropleth("Median income (dollars)",
-                    f"visualizations/nyc_zips_income_{year}_choropleth.html",
-                    df_zip_income)
+def draw_income_scatter(df: pd.DataFrame, filename: str):
+    """
+    This function takes two inputs:
+    df: an expanded Income by ZIP DataFrame, with outlier housing counts already capped.
+    filename: the name of a file to save the graph to.
 
-def find_best_degree(x_train, y_train):
+    Draws the Step 4 scatterplot of median income vs. H/H ratio for every ZIP.
     """
-    This function takes in two inputs:
-    x_train: a training set produced by train_test_split.
-    y_train: a training set produced by train_test_split.
+    plt.figure()
+    sns.scatterplot(
+        data=df,
+        x="Median income (dollars)",
+        y="Housing to Households Ratio",
+        hue="Borough",
+        size="Total Affordable Housing",
+        sizes=(20,200)
+    ).set(title="Housing to Household Ratios per ZIP")
+    plt.savefig(filename)
 
-    Using these two training sets, return the best degree for a polynomial regression
-    and the MSE for that degree.
-    Taken from fit_poly() of assignment 7.
+def draw_regression_scatter(df: pd.DataFrame, x_test: list, y_pred: list, filename: str):
     """
-    # stores paired values of best degree found so far and its corresponding error value
-    degree_error_combo = [-1, 2**32]
-    # if the current regression degree is better than the prev one by less than this %
-    # then it is considered "good enough".
-    min_error_threshold = 0.05
-    for degree in range(1,12):
-        poly = PolynomialFeatures(degree=degree)
-        poly_features = poly.fit_transform(x_train.to_frame())
+    This function takes four inputs:
+    df: a DataFrame containing x and y columns to source scatterplot points from.
+    x_test: list of x-values for the regression line.
+    y_pred: list of y-values for the regression line.
+    filename: the name of a file to save the graph to.
 
-        #print("poly features:")
-        #print(poly_features)
-        reg = linear_model.LinearRegression().fit(poly_features, y_train)
-        y_predicted = reg.predict(poly_features)
-        error = mean_squared_error(y_train, y_predicted)
+    Draws the Step 5.5 scatterplot with the model's prediction line.
+    """
+    plt.figure()
+    sns.scatterplot(
+        data=df,
+        x="Median income (dollars)",
+        y="Housing to Households Ratio",
+        hue="Borough",
+        size="Total Affordable Housing",
+        sizes=(20,200)
+    ).set(title="Housing to Household Ratios per ZIP with regression line")
+    plt.plot(x_test, y_pred, color="black")
+    plt.savefig(filename)
+
+def draw_regression_error(df: pd.DataFrame, year: int, filename: str):
+    """
+    This function takes three inputs:
+    df: a DataFrame with the "Predicted/Actual Error" of every ZIP (see predict()).
+    year: the year the data corresponds to.
+    filename: the name of a file to save the graph to.
+
+    Draws the Step 5.5 regression graph: the error of the model relative to all data.
+    """
+    plt.figure()
+    sns.scatterplot(
+        data=df,
+        x="Median income (dollars)",
+        y="Predicted/Actual Error",
+        #hue="Borough",
+        #size="Total Affordable Housing",
+        #sizes=(20,200)
+    ).set(title=f"Regression graph for year {year}")
+    plt.axhline(y=0, color="black")
+    plt.savefig(filename)
+
+def draw_predictions_overlaid(lines: list, title: str, filename: str):
+    """
+    This function takes three inputs:
+    lines: a list of (x-values, y-values, color) of every prediction line.
+    title: the title of the graph.
+    filename: the name of a file to save the graph to.
+
+    Draws every year's prediction line on one graph.
+    """
+    plt.figure(figsize=(6,6))
+    plt.ylim(0.0, 0.1)
+    plt.title(title)
+    plt.ylabel("Average Housing to Household Ratio")
+    plt.xlabel("Area Median Income")
+    for x_test, y_predicted, color in lines:
+        plt.plot(x_test, y_predicted, color=color)
+    plt.savefig(filename)
+
+@traced
+def render_figure(figure_spec: tuple, show: bool = False):
+    """
+    This function takes two inputs:
+    figure_spec: a (drawing function, dict of its arguments) pair, such as
+    (draw_regression_error, {"df": df, "year": 2020, "filename": "error.png"}).
+    show: whether plt.show() is called once the figure is drawn.
+
+    Draws one figure on a new matplotlib figure, so no figure is drawn over another one,
+    and closes it afterwards.
+    """
+    draw_figure, arguments = figure_spec
+    draw_figure(**arguments)
+    if show:
+        plt.show()
+    plt.close("all")
+
+def queue_figure(figures, draw_figure, **arguments):
+    """
+    This function takes two or more inputs:
+    figures: a list that collects figure specs for render_figures(), or None.
+    draw_figure: the function that draws the figure.
+    arguments: the arguments to draw_figure.
+
+    Adds the figure to figures, or draws and shows it right away if figures is None.
+    """
+    if figures is None:
+        render_figure((draw_figure, arguments), show=True)
+    else:
+        figures.append((draw_figure, arguments))
+
+def render_figures(figures: list, workers: int = None):
+    """
+    This function takes two inputs:
+    figures: a list of figure specs (see render_figure()).
+    workers: number of processes to draw with. None uses one per CPU core,
+    and 1 draws every figure in this process.
+
+    Draws every figure with the headless backend, spread across a process pool.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(figures))
+    if workers <= 1:
+        use_headless_backend()
+        for figure_spec in figures:
+            render_figure(figure_spec)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=use_headless_backend) as pool:
+        # this also raises any error from a worker here
+        for _, events in pool.map(functools.partial(call_traced, render_figure), figures):
+            TRACER.events += events
+
+@traced
+def draw_graphs(income_csv, choropleth_name: str, year: int, zips=None, figures: list = None):
+    """
+    Step 4: draw graphs relevant to the project.
+
+    This function takes in 5 inputs:
+    income_csv: name of a Income by ZIP csv to read, or an expanded Income by ZIP DataFrame.
+    choropleth_name: name that the folium choropleth map should be saved to.
+    year: the year corresponding to the income csv, to be used in naming some things.
+    zips: the already loaded simplified ZCTA geojson (see load_simplified_zcta()),
+    loaded here if not given.
+    figures: a list to queue the graphs in (see queue_figure()). If not given,
+    the graphs are drawn and shown right away.
+    """
+    print("Beginning Step 4: drawing graphs")
+    if isinstance(income_csv, pd.DataFrame):
+        df_zip_income = income_csv.copy()
+    else:
+        df_zip_income = pd.read_csv(income_csv)
+
+    # scatter plot: area median income vs. Housing to Households Ratio
+    # These lines fix an issue where the NYC column has a Total Affordable Housing value of
+    # 200k and ruins the Seaborn scatterplot dot size scaling system.
+    df_zip_income_mod = df_zip_income
+    df_zip_income_mod["Total Affordable Housing"] = \
+        df_zip_income_mod["Total Affordable Housing"].apply(lambda housing: min(housing, 50000))
+
+    queue_figure(figures, draw_income_scatter, df=df_zip_income_mod,
+                 filename=f"visualizations/NYC_Housing_to_Household_by_ZIP_{year}.png")
+
+    if zips is None:
+        zips = load_simplified_zcta("nyc-zip-code-tabulation-areas-polygons.geojson")
+    # every map of every year loads the same geometry file
+    asset_name = write_zcta_asset(zips)
+
+    # =======================================================
+    # based on the examples on the Folium Quick Start webpage
+    # because a few outliers are making it hard to show the finer details of the other zips:
+    # the H/H ratio layer excludes these outliers.
+    # the median income can be switched on as a second layer to compare the two.
+    queue_figure(figures, draw_choropleth_layers,
+                 layers=[("Housing to Households Ratio",
+                          df_zip_income[df_zip_income["Housing to Households Ratio"] < 0.5],
+                          "Housing to Household Ratio"),
+                         ("Median income (dollars)", df_zip_income, "Median income (dollars)")],
+                 filename=choropleth_name, zips=zips, asset_name=asset_name)
+
+    # a choropleth on average income on its own (the map the README links to)
+    queue_figure(figures, draw_choropleth_layers,
+                 layers=[("Median income (dollars)", df_zip_income, "Median income (dollars)")],
+                 filename=f"visualizations/nyc_zips_income_{year}_choropleth.html",
+                 zips=zips, asset_name=asset_name)
+
+@traced
+def find_best_degree(x_train, y_train, max_degree: int = 11):
+    """
+    This function takes in three inputs:
+    x_train: a training set produced by train_test_split.
+    y_train: a training set produced by train_test_split.
+    max_degree: the highest polynomial degree to try.
+
+    Using these two training sets, return the best degree for a polynomial regression
+    and the MSE for that degree.
+    Taken from fit_poly() of assignment 7.
+
+    Incomes around 200,000 raised to high powers make a badly conditioned design matrix,
+    so the incomes are first scaled to [-1, 1] and the polynomial basis is built out of
+    Chebyshev polynomials. The basis is orthogonalized once with a QR decomposition:
+    the least squares fit of degree d is then the fit of degree d - 1 plus the projection
+    onto one more orthonormal column, so each degree only updates the previous residuals
+    instead of refitting from scratch.
+
+    A training set of n rows is already fitted exactly by degree n - 1, so the basis stops
+    there and any higher degree keeps the residuals of that exact fit.
+    """
+    x_values = np.asarray(x_train, dtype=float)
+    y_values = np.asarray(y_train, dtype=float)
+    x_min, x_max = x_values.min(), x_values.max()
+    x_scaled = (2 * x_values - (x_max + x_min)) / ((x_max - x_min) or 1.0)
+    # column k of q_basis spans the part of the degree k polynomial not covered by lower degrees
+    basis_degree = min(max_degree, len(x_values) - 1)
+    q_basis, _ = np.linalg.qr(np.polynomial.chebyshev.chebvander(x_scaled, basis_degree))
+    # the degree 0 fit (a constant), which every later degree builds on
+    residuals = y_values - q_basis[:, 0] * (q_basis[:, 0] @ y_values)
+
+    # stores paired values of best degree found so far and its corresponding error value
+    degree_error_combo = [-1, 2**32]
+    # if the current regression degree is better than the prev one by less than this %
+    # then it is considered "good enough".
+    min_error_threshold = 0.05
+    for degree in range(1, max_degree + 1):
+        if degree <= basis_degree:
+            residuals = residuals - q_basis[:, degree] * (q_basis[:, degree] @ residuals)
+        error = float(residuals @ residuals) / len(residuals)
         print(f"Testing linear regression model of degree {degree}")
         print("Mean Squared Error is: ", error)
         if error < degree_error_combo[1]:
@@ -651,21 +1692,26 @@ def find_best_degree(x_train, y_train):
     print()
     return degree_error_combo[0], degree_error_combo[1]
 
+@traced
 def draw_regression(df: pd.DataFrame,
                     x_test: list,
                     y_pred: list,
                     scatter_name: str,
                     regression_name: str,
-                    year: int):
+                    year: int,
+                    figures: list = None):
     """
     Step 5.5: draw regression graphs.
 
-    This function takes in 5 inputs:
+    This function takes in 7 inputs:
     df: a DataFrame containing x and y columns to source scatterplot points from.
     x_test: list of x-values for the regression line.
     y_pred: list of y-values for the regression line.
     scatter_name: name of the scatterplot to be saved.
     regression_name: name of the regression graph to be saved.
+    year: the year the data corresponds to.
+    figures: a list to queue the graphs in (see queue_figure()). If not given,
+    the graphs are drawn and shown right away.
 
     Using the inputs, this function draws a scatterplot with model prediction line
     and a regression scatterplot showing the error of the model relative to all data.
@@ -673,31 +1719,9 @@ def draw_regression(df: pd.DataFrame,
     """
     print("Step 5.5: drawing scatter and regression graphs")
     print("Graphs are for year", year)
-    sns.scatterplot(
-        data=df,
-        x="Median income (dollars)",
-        y="Housing to Households Ratio",
-        hue="Borough",
-        size="Total Affordable Housing",
-        sizes=(20,200)
-    ).set(title="Housing to Household Ratios per ZIP with regression line")
-    plt.plot(x_test, y_pred, color="black")
-    plt.savefig(scatter_name)
-    plt.show()
-    plt.clf()
-
-    sns.scatterplot(
-        data=df,
-        x="Median income (dollars)",
-        y="Predicted/Actual Error",
-        #hue="Borough",
-        #size="Total Affordable Housing",
-        #sizes=(20,200)
-    ).set(title=f"Regression graph for year {year}")
-    plt.axhline(y=0, color="black")
-    plt.savefig(regression_name)
-    plt.show()
-    plt.clf()
+    queue_figure(figures, draw_regression_scatter,
+                 df=df, x_test=x_test, y_pred=y_pred, filename=scatter_name)
+    queue_figure(figures, draw_regression_error, df=df, year=year, filename=regression_name)
 
 def cleanup_floats(value: float)->float:
     """
@@ -710,20 +1734,309 @@ def cleanup_floats(value: float)->float:
         return 0
     return value
 
-def predict(income_csv: str,
+# LassoCV's defaults: 5 unshuffled folds and 100 alphas spaced down to alpha_max / 1000.
+LASSO_CV_FOLDS = 5
+LASSO_N_ALPHAS = 100
+LASSO_ALPHA_EPS = 1e-3
+
+def split_model_data(df_zip_income: pd.DataFrame)->tuple:
+    """
+    This function takes one input:
+    df_zip_income: a DataFrame of expanded Income by ZIP data.
+
+    Returns the x_train, x_test, y_train, y_test split of median incomes
+    and H/H ratios that every Step 5 model is fitted and scored on.
+    """
+    return train_test_split(df_zip_income["Median income (dollars)"],
+                            df_zip_income["Housing to Households Ratio"],
+                            test_size=0.25,
+                            random_state=10000)
+
+def lasso_alpha_grid(features: np.ndarray, target: np.ndarray)->np.ndarray:
+    """
+    This function takes two inputs:
+    features: the polynomial features of the training set.
+    target: the H/H ratios of the training set.
+
+    Returns the alphas LassoCV would try for this training set, largest first.
+    """
+    # the correlation of each centered feature with the target, computed the way LassoCV does
+    target_centered = target - target.mean()
+    feature_target = features.T @ target_centered - features.mean(axis=0) * target_centered.sum()
+    alpha_max = np.sqrt(np.max(feature_target ** 2)) / len(target)
+    return np.geomspace(alpha_max, alpha_max * LASSO_ALPHA_EPS, num=LASSO_N_ALPHAS)
+
+def lasso_fold_errors(features: np.ndarray,
+                      target: np.ndarray,
+                      train: np.ndarray,
+                      test: np.ndarray,
+                      alphas: np.ndarray)->np.ndarray:
+    """
+    This function takes five inputs:
+    features: the polynomial features of the training set.
+    target: the H/H ratios of the training set.
+    train: row numbers of the cross validation fold's training rows.
+    test: row numbers of the cross validation fold's held out rows.
+    alphas: the alphas to try, largest first.
+
+    Fits the fold's whole regularization path and returns the MSE of every alpha
+    on the held out rows.
+    The fold's Gram matrix is computed once and handed to lasso_path() with
+    check_input=False, since LassoCV validates it again for every single alpha
+    and that took far longer than the fits themselves.
+    """
+    x_offset = features[train].mean(axis=0)
+    y_offset = target[train].mean()
+    x_train = np.asfortranarray(features[train] - x_offset)
+    y_train = target[train] - y_offset
+    gram = x_train.T @ x_train
+    _, coefs, _ = linear_model.lasso_path(x_train, y_train, alphas=alphas,
+                                          precompute=gram, Xy=x_train.T @ y_train,
+                                          check_input=False)
+    residuals = (features[test] - x_offset) @ coefs + y_offset - target[test][:, np.newaxis]
+    return (residuals ** 2).mean(axis=0)
+
+def fit_lasso(features: np.ndarray,
+              target: np.ndarray,
+              fold_errors: list,
+              alphas: np.ndarray,
+              coef_init: np.ndarray = None):
+    """
+    This function takes five inputs:
+    features: the polynomial features of the training set.
+    target: the H/H ratios of the training set.
+    fold_errors: the output of lasso_fold_errors() for every cross validation fold.
+    alphas: the alphas the folds tried.
+    coef_init: coefficients to start the fit from, such as last year's model's.
+
+    Returns a Lasso model refitted on the whole training set
+    with the alpha that had the lowest mean error across the folds.
+    """
+    best_alpha = alphas[np.argmin(np.mean(fold_errors, axis=0))]
+    model = linear_model.Lasso(alpha=best_alpha, warm_start=coef_init is not None)
+    if coef_init is not None:
+        model.coef_ = coef_init.copy()
+    return model.fit(features, target)
+
+class HHRatioModel:
+    """
+    A fitted Step 5 model of a year's H/H ratios: the polynomial transform of
+    median incomes and the Lasso regressor fitted on it.
+
+    The polynomial features of the training set are made once and kept, and predict()
+    turns any array of incomes into one feature matrix and one matrix multiplication.
+
+    Example:
+    model = HHRatioModel(2019, 2, x_train, y_train).fit()
+    model.predict(np.linspace(0, 200000, 1000000))
+    """
+    def __init__(self, year: int, degree: int, x_train, y_train):
+        """
+        This function takes four inputs:
+        year: the year the model is fitted for.
+        degree: the model's polynomial degree (see find_best_degree()).
+        x_train: median incomes of the training set.
+        y_train: H/H ratios of the training set.
+        """
+        self.year = year
+        self.degree = degree
+        self.poly = PolynomialFeatures(degree=degree)
+        self.training_features = \
+            self.poly.fit_transform(np.asarray(x_train, dtype=float).reshape(-1, 1))
+        self.training_target = np.asarray(y_train, dtype=float)
+        self.alphas = lasso_alpha_grid(self.training_features, self.training_target)
+        self.regressor = None
+        # scores on the test set, filled in by score()
+        self.mse = None
+        self.r2 = None
+
+    def fold_errors(self, folds: list = None)->list:
+        """
+        This function takes one input:
+        folds: train and test row numbers of every cross validation fold.
+        LassoCV's unshuffled folds are used if not given.
+
+        Returns the output of lasso_fold_errors() for every fold.
+        """
+        if folds is None:
+            folds = KFold(LASSO_CV_FOLDS).split(self.training_features)
+        return [lasso_fold_errors(self.training_features, self.training_target,
+                                  train, test, self.alphas) for train, test in folds]
+
+    def fit(self, fold_errors: list = None, coef_init: np.ndarray = None):
+        """
+        This function takes two inputs:
+        fold_errors: the cross validation errors of this model's alphas,
+        computed with fold_errors() if not given.
+        coef_init: coefficients to start the fit from, such as last year's model's.
+
+        Fits the regressor on the cached training features and returns the model itself.
+        """
+        if fold_errors is None:
+            fold_errors = self.fold_errors()
+        self.regressor = fit_lasso(self.training_features, self.training_target,
+                                   fold_errors, self.alphas, coef_init)
+        return self
+
+    def features(self, incomes)->np.ndarray:
+        """
+        This function takes one input:
+        incomes: an array (or list, or Series) of median incomes.
+
+        Returns the polynomial features of the incomes.
+        """
+        incomes = np.asarray(incomes, dtype=float).reshape(-1, 1)
+        # sklearn refuses to transform 0 rows
+        if len(incomes) == 0:
+            return np.empty((0, self.degree + 1))
+        return self.poly.transform(incomes)
+
+    def predict(self, incomes)->np.ndarray:
+        """
+        This function takes one input:
+        incomes: an array (or list, or Series) of median incomes.
+
+        Returns the predicted H/H ratio of every income.
+        """
+        return self.features(incomes) @ self.regressor.coef_ + self.regressor.intercept_
+
+    def score(self, x_test, y_test)->np.ndarray:
+        """
+        This function takes two inputs:
+        x_test: median incomes of the test set.
+        y_test: H/H ratios of the test set.
+
+        Stores the model's MSE and r2 score on the test set and returns its predictions.
+        """
+        y_predicted = self.predict(x_test)
+        self.mse = mean_squared_error(y_test, y_predicted)
+        self.r2 = r2_score(y_test, y_predicted)
+        return y_predicted
+
+    def to_dict(self)->dict:
+        """
+        Returns everything needed to rebuild the fitted model (see from_dict()),
+        as a JSON serializable dict.
+        """
+        return {"year": self.year,
+                "degree": self.degree,
+                "alpha": float(self.regressor.alpha),
+                "intercept": float(self.regressor.intercept_),
+                "coefficients": [float(coef) for coef in self.regressor.coef_],
+                "mse": self.mse,
+                "r2": self.r2}
+
+    @classmethod
+    def from_dict(cls, model_dict: dict):
+        """
+        This function takes one input:
+        model_dict: the output of to_dict().
+
+        Returns a ready to score HHRatioModel, without refitting it.
+        The model does not keep its training set, so it cannot be refitted.
+        """
+        model = cls.__new__(cls)
+        model.year = model_dict["year"]
+        model.degree = model_dict["degree"]
+        model.poly = PolynomialFeatures(degree=model.degree).fit(np.zeros((1, 1)))
+        model.training_features = None
+        model.training_target = None
+        model.alphas = None
+        model.regressor = linear_model.Lasso(alpha=model_dict["alpha"])
+        model.regressor.coef_ = np.array(model_dict["coefficients"])
+        model.regressor.intercept_ = model_dict["intercept"]
+        model.mse = model_dict["mse"]
+        model.r2 = model_dict["r2"]
+        return model
+
+# Every year's fitted model is saved here, so it can be loaded back without refitting.
+MODEL_REGISTRY_DIR = "model_registry"
+
+def model_data_digest(df_zip_income: pd.DataFrame)->str:
+    """
+    This function takes one input:
+    df_zip_income: a DataFrame of expanded Income by ZIP data.
+
+    Returns the SHA-256 hex digest of the rows and columns a Step 5 model is trained on,
+    which changes whenever the model would have to be refitted.
+    """
+    model_columns = df_zip_income[["Median income (dollars)", "Housing to Households Ratio"]]
+    row_hashes = pd.util.hash_pandas_object(model_columns, index=True).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+def model_registry_path(year: int, registry_dir: str = MODEL_REGISTRY_DIR)->str:
+    """
+    This function takes two inputs:
+    year: the year of a model.
+    registry_dir: the folder models are saved in.
+
+    Returns the name of the file the year's model is saved to.
+    """
+    return os.path.join(registry_dir, f"hh_ratio_model_{year}.json")
+
+def save_model(model: HHRatioModel, dataset_hash: str, registry_dir: str = MODEL_REGISTRY_DIR):
+    """
+    This function takes three inputs:
+    model: a fitted and scored HHRatioModel.
+    dataset_hash: model_data_digest() of the data set the model was fitted on.
+    registry_dir: the folder models are saved in.
+
+    Saves the model, its scores and the hash of its data set to the registry.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    path = model_registry_path(model.year, registry_dir)
+    with open(f"{path}.tmp", mode="w", encoding="utf_8") as model_file:
+        json.dump({**model.to_dict(), "dataset_hash": dataset_hash,
+                   "version": ARTIFACT_CACHE_VERSION}, model_file, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+def load_model(year: int, dataset_hash: str = None, registry_dir: str = MODEL_REGISTRY_DIR):
+    """
+    This function takes three inputs:
+    year: the year of the model to load.
+    dataset_hash: model_data_digest() of the data set the model should have been fitted on.
+    If not given, whatever model is saved for the year is loaded.
+    registry_dir: the folder models are saved in.
+
+    Returns the year's saved HHRatioModel, or None if no model is saved for the year,
+    or it was fitted on a different data set or by older code (so it has to be refitted).
+
+    Example:
+    load_model(2019).predict([40000, 80000])
+    """
+    path = model_registry_path(year, registry_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, mode="r", encoding="utf_8") as model_file:
+        model_dict = json.load(model_file)
+    if model_dict.get("version") != ARTIFACT_CACHE_VERSION:
+        return None
+    if dataset_hash is not None and model_dict["dataset_hash"] != dataset_hash:
+        return None
+    return HHRatioModel.from_dict(model_dict)
+
+@traced
+def predict(income_csv,
             scatterplot_name: str,
             regression_name: str,
             graphing: bool,
-            year: int):
+            year: int,
+            figures: list = None,
+            model: HHRatioModel = None):
     """
     Step 5: predict values.
 
-    This function takes in 5 inputs:
-    income_csv: name of a Income by ZIP data file to read from.
+    This function takes in 7 inputs:
+    income_csv: name of a Income by ZIP data file to read from, or an expanded
+    Income by ZIP DataFrame (see Step 3) to use directly.
     scatterplot_name: name of a scatter plot to be generated.
     regression_name: name of a regression plot to be generated.
     graphing: tells the function if it should draw graphs.
     year: year corresponding to the income by ZIP data file.
+    figures: a list to queue the graphs in (see queue_figure()). If not given,
+    the graphs are drawn and shown right away.
+    model: the year's already fitted HHRatioModel (see fit_year_models()), which is used
+    as is. A new model is fitted if not given.
 
     This function tries to create a linear regression model to predict
     a zipcode's H/H ratio based on its average median income.
@@ -731,31 +2044,32 @@ def predict(income_csv: str,
     Work for this function is lifted from several functions from Assignment 7.
     """
     print("Beginning Step 5: attempting to do predictive modeling")
-    print(f"Data set to be processed: {income_csv}")
+    if isinstance(income_csv, pd.DataFrame):
+        print(f"Data set to be processed: Income by ZIP data for {year}")
+        df_zip_income = income_csv.copy()
+    else:
+        print(f"Data set to be processed: {income_csv}")
+        df_zip_income = pd.read_csv(income_csv)
     print()
-    df_zip_income = pd.read_csv(income_csv)
-
-    x_train,x_test,y_train,y_test =\
-        train_test_split(df_zip_income["Median income (dollars)"],\
-                         df_zip_income["Housing to Households Ratio"],
-                         test_size=0.25,
-                         random_state=10000)
 
-    # taken from fit_poly() of assignment 7
+    x_train,x_test,y_train,y_test = split_model_data(df_zip_income)
 
-    best_degree, best_error = find_best_degree(x_train, y_train)
-    print("Best degree and error:")
-    print(best_degree)
-    print(best_error)
+    if model is None:
+        # taken from fit_poly() of assignment 7
 
-    # taken from fit_model() of assignment 7
+        best_degree, best_error = find_best_degree(x_train, y_train)
+        print("Best degree and error:")
+        print(best_degree)
+        print(best_error)
 
-    poly = PolynomialFeatures(degree=best_degree)
-    poly_features = poly.fit_transform(x_train.to_frame())
-    my_reg = linear_model.LassoCV(random_state=year).fit(poly_features, y_train)
+        # taken from fit_model() of assignment 7
 
-    x_test_poly = poly.fit_transform(x_test.to_frame())
-    y_predicted = my_reg.predict(x_test_poly)
+        model = HHRatioModel(year, best_degree, x_train, y_train).fit()
+        y_predicted = model.score(x_test, y_test)
+    else:
+        # the model was already scored on this same test set when it was fitted
+        y_predicted = model.predict(x_test)
+    my_reg = model.regressor
 
     print()
     print("my_reg coefficients and intercept:")
@@ -770,8 +2084,8 @@ def predict(income_csv: str,
     # print(y_test)
 
     print("MSE and r2 scores for this regression:")
-    print(mean_squared_error(y_test, y_predicted))
-    print(r2_score(y_test, y_predicted))
+    print(model.mse)
+    print(model.r2)
     print()
 
     # "deals with" outliers by artificially reducing them to 50000
@@ -781,10 +2095,7 @@ def predict(income_csv: str,
         df_zip_income["Total Affordable Housing"].apply(lambda housing: min(housing, 50000))
 
     # calculating error of this regression so it can be plotted
-    x_test_poly_all = poly.fit_transform(df_zip_income["Median income (dollars)"].to_frame())
-    y_predicted_all = my_reg.predict(x_test_poly_all)
-
-    df_zip_income["Predicted H/H Ratio"] = y_predicted_all
+    df_zip_income["Predicted H/H Ratio"] = model.predict(df_zip_income["Median income (dollars)"])
     df_zip_income["Predicted H/H Ratio"].apply(lambda ratio: round(ratio, 3))
     df_zip_income["Predicted/Actual Error"] = \
         df_zip_income["Predicted H/H Ratio"] - \
@@ -796,55 +2107,124 @@ def predict(income_csv: str,
                         y_predicted,
                         scatterplot_name,
                         regression_name,
-                        year)
+                        year,
+                        figures)
 
-    # returning some x and y values to be graphed to show a particular year's predictions.
-    # the x, y values are custom made to ensure the prediction line is smooth
-    my_x_test = []
-    for xval in range(0, 200000, 1000):
-        my_x_test.append(xval)
-    my_x_test_poly = poly.fit_transform(pd.Series(my_x_test).to_frame())
-    my_y_predicted = my_reg.predict(my_x_test_poly)
+    my_x_test, my_y_predicted = prediction_line(model)
 
     print("Predictive modeling step complete")
     print()
 
-    # returns useful information on the regression prediction to be stored in a csv somewhere
-    output_summary_list = [year, best_degree,
-                           mean_squared_error(y_test, y_predicted),
-                           r2_score(y_test, y_predicted),
-                           my_reg.intercept_]
-    for element in my_reg.coef_:
+    return my_x_test,\
+            my_y_predicted,\
+            model_summary_row(model)
+
+def prediction_line(model: HHRatioModel)->tuple:
+    """
+    This function takes one input:
+    model: a fitted HHRatioModel.
+
+    Returns some x and y values to be graphed to show a particular year's predictions.
+    The x values are custom made (every 1000 dollars up to 200000)
+    to ensure the prediction line is smooth.
+    """
+    my_x_test = list(range(0, 200000, 1000))
+    return my_x_test, model.predict(my_x_test)
+
+def model_summary_row(model: HHRatioModel)->list:
+    """
+    This function takes one input:
+    model: a fitted HHRatioModel, scored on its test set (see HHRatioModel.score()).
+
+    Returns useful information on the regression prediction to be stored in a csv somewhere
+    (one row of coefficients_errors_per_year.csv).
+    """
+    output_summary_list = [model.year, model.degree, model.mse, model.r2,
+                           model.regressor.intercept_]
+    for element in model.regressor.coef_:
         output_summary_list.append(element)
     # most regressions have a degree of 2 but some have 3
     # this resolves the issue of fitting degree 2 coefs for a df that accepts degree 3 coefs
     if len(output_summary_list) < 9:
         output_summary_list.append(0.0)
+    return output_summary_list
 
-    return my_x_test,\
-            my_y_predicted,\
-            output_summary_list
-
-def main():
-    """
-    Main function.
+@traced
+def fit_year_models(dfs_expanded: dict, workers: int = None, registry_dir: str = None)->tuple:
     """
-    print("Beginning project steps")
-
-    # this only needs to be called once, since housing data for all years are all in one csv.
-    clean_store_ahs_data("Affordable_Housing_Production_by_Building.csv",
-                         "AHP_by_Building_cleaned.csv")
+    Step 5 for every year at once.
 
-    # the 2 calls below will be repeated for every year-based zipcode income prediction.
-    # Important: do not include margin of error in the raw csv files
+    This function takes three inputs:
+    dfs_expanded: a dict of year -> expanded Income by ZIP DataFrame (see Step 3).
+    workers: number of threads the cross validation folds are spread across.
+    None uses one per CPU core.
+    registry_dir: a model registry folder (see save_model()). Years whose saved model was
+    fitted on the same data are loaded from it instead of refitted, and every refitted
+    model is saved to it. The registry is not used if not given.
+
+    Fits the same models predict() does for each year, without drawing graphs.
+    Each year's polynomial features are made once (see HHRatioModel) and reused
+    for the alpha grid, every fold and the refit. The cross validation folds of every year
+    are independent of each other, so they all run side by side (the coordinate descent
+    releases the GIL, so threads are enough). Years are refitted in order, and each refit
+    starts from the coefficients of the last year that had the same degree.
+
+    Returns two values:
+    a dict of year -> that year's fitted HHRatioModel,
+    and a DataFrame of every year's model laid out like coefficients_errors_per_year.csv.
+    """
+    print("Beginning Step 5: fitting the predictive models for", len(dfs_expanded), "years")
+    years = sorted(dfs_expanded)
+    # one fold splitter for every year. years with as many training rows share their folds
+    splitter = KFold(LASSO_CV_FOLDS)
+    folds_by_size = {}
+    models = {}
+    test_sets = {}
+    dataset_hashes = {}
+    for year in years:
+        if registry_dir is not None:
+            dataset_hashes[year] = model_data_digest(dfs_expanded[year])
+            saved_model = load_model(year, dataset_hashes[year], registry_dir)
+            if saved_model is not None:
+                print(f"Loaded the model for {year} from {registry_dir}")
+                models[year] = saved_model
+                continue
+        x_train, x_test, y_train, y_test = split_model_data(dfs_expanded[year])
+        best_degree, _ = find_best_degree(x_train, y_train)
+        models[year] = HHRatioModel(year, best_degree, x_train, y_train)
+        test_sets[year] = (x_test, y_test)
+        if len(y_train) not in folds_by_size:
+            folds_by_size[len(y_train)] = list(splitter.split(models[year].training_features))
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        fold_jobs = {year: [pool.submit(lasso_fold_errors, model.training_features,
+                                        model.training_target, train, test, model.alphas)
+                            for train, test in folds_by_size[len(model.training_target)]]
+                     for year, model in models.items() if year in test_sets}
+        fold_errors = {year: [job.result() for job in jobs] for year, jobs in fold_jobs.items()}
+
+    summary_rows = []
+    last_coefs = {}
+    for year in years:
+        model = models[year]
+        if year in test_sets:
+            model.fit(fold_errors[year], last_coefs.get(model.degree))
+            model.score(*test_sets[year])
+            if registry_dir is not None:
+                save_model(model, dataset_hashes[year], registry_dir)
+        last_coefs[model.degree] = model.regressor.coef_
+        summary_rows.append(model_summary_row(model))
+    print("Predictive modeling step complete")
+    print()
+    return models, coefficients_frame(summary_rows)
 
-    for year in range(2011, 2022):
-        print(f"Cleaning and modifying data for year {year}")
-        clean_store_income_data(f"raw_datasets/NYC_income_by_zip_{year}.csv",
-                                f"processed_datasets/NYC_Income_by_ZIP_{year}_Cleaned.csv", year)
-        add_data_to_income(f"processed_datasets/NYC_Income_by_ZIP_{year}_Cleaned.csv",
-                           f"processed_datasets/NYC_Income_by_ZIP_{year}_Expanded.csv", year)
+def coefficients_frame(summary_rows: list)->pd.DataFrame:
+    """
+    This function takes one input:
+    summary_rows: the summary row of every year's model (see model_summary_row()).
 
+    Returns the rows as a DataFrame laid out like coefficients_errors_per_year.csv.
+    """
     # initializing a dict to turn into a df to store predictive model outputs for each year
     predictions_dict = {"Year": [0],
                         "Degree": [0],
@@ -859,74 +2239,1869 @@ def main():
     predictions_df = pd.DataFrame.from_dict(predictions_dict)
     #print(predictions_df)
 
-    # preliminary prediction on the 2021 data set and drawing a regression graph
-    predict("processed_datasets/NYC_Income_by_ZIP_2021_Expanded.csv",
-           "visualizations/NYC_Household_vs_Income_with_regression_2021.png",
-           "visualizations/Regression_error_graph_2021.png", graphing=True, year=2021)
+    for new_row in summary_rows:
+        # add new row to end of predictions df with data on the model for each year
+        predictions_df.loc[len(predictions_df.index)] = new_row
 
-    # making models for 2011 to 2021 data sets and retrieving the x and y values
-    # for each model so that they can be all graphed at once
+    predictions_df = predictions_df.astype({"Year": "int32", "Degree": "int32"})
 
-    # dictionary of years and corresponding line colors.
-    # 2020 is in blue to highlight the fact that its model is weird and should be investigated
-    line_colors_dict = {2021: "#ff0000",
-                        2020: "#0000dd",
-                        2019: "#bb0000",
-                        2018: "#990000",
-                        2017: "#880000",
-                        2016: "#770000",
-                        2015: "#660000",
-                        2014: "#550000",
-                        2013: "#330000",
-                        2012: "#110000",
-                        2011: "#000000"}
+    for var_col_name in ["var1", "var2", "var3", "var0"]:
+        predictions_df[var_col_name] = predictions_df[var_col_name].apply(cleanup_floats)
+    return predictions_df[predictions_df["Year"] != 0]
 
-    sns.FacetGrid(pd.read_csv("processed_datasets/NYC_Income_by_ZIP_2021_expanded.csv"))
-    plt.figure(figsize=(6,6))
-    plt.ylim(0.0, 0.1)
-    plt.title("Predictive models from 2011 (black) to 2021 (red)")
-    plt.ylabel("Average Housing to Household Ratio")
-    plt.xlabel("Area Median Income")
+# Intermediate DataFrames produced by the project steps are cached in this folder.
+ARTIFACT_CACHE_DIR = ".artifact_cache"
+# Bump this whenever a step's code changes what it produces, so old artifacts stop matching.
+ARTIFACT_CACHE_VERSION = 3
 
-    for year in range(2011, 2022):
-        x_test, y_predicted, new_row = \
-        predict(f"processed_datasets/NYC_Income_by_ZIP_{year}_expanded.csv",
-                f"visualizations/NYC_Household_vs_Income_with_regression_{year}.png",
-                f"visualizations/Regression_error_graph_{year}.png", False, year)
+def file_digest(file_name: str)->str:
+    """
+    This function takes one input:
+    file_name: the name of a file to hash.
 
-        # add new row to end of predictions df with data on the model for each year
-        predictions_df.loc[len(predictions_df.index)] = new_row
+    Returns the SHA-256 hex digest of the file's contents.
+    """
+    hasher = hashlib.sha256()
+    with open(file_name, mode="rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
 
-        # add regression line to graph
-        plt.plot(x_test, y_predicted, color=line_colors_dict[year])
-        # couldn't figure out a way to manipulate predictions_df to fit into sns
-        # to neatly produce a bunch of lines based on x-vals, y-vals, and year
-        # so instead here's a less elegant solution of adding each line individually
+def artifact_key(step_name: str, inputs: list, params: dict)->str:
+    """
+    This function takes three inputs:
+    step_name: name of the project step producing the artifact.
+    inputs: digests of the input files and/or keys of the artifacts the step reads.
+    params: any other values the step's output depends on (must be JSON serializable).
 
-    plt.savefig("visualizations/NYC_Housing_vs_Income_2011-2021_predictions_overlaid.png")
-    plt.show()
+    Returns a key that changes whenever any of the inputs or parameters change.
+    """
+    payload = json.dumps({"step": step_name,
+                          "version": ARTIFACT_CACHE_VERSION,
+                          "inputs": inputs,
+                          "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf_8")).hexdigest()
 
-    predictions_df = predictions_df.astype({"Year": "int32", "Degree": "int32"})
+def artifact_path(key: str, file_format: str = ARTIFACT_FORMAT)->str:
+    """
+    This function takes two inputs:
+    key: an artifact key produced by artifact_key().
+    file_format: the file extension of the artifact.
 
-    for var_col_name in ["var1", "var2", "var3", "var0"]:
-        predictions_df[var_col_name] = predictions_df[var_col_name].apply(cleanup_floats)
+    Returns the name of the file the artifact is cached in.
+    """
+    return os.path.join(ARTIFACT_CACHE_DIR, f"{key}.{file_format}")
 
-    #print("printing full predictions df before it is saved to csv:")
-    #print(predictions_df)
-    predictions_df[predictions_df["Year"] != 0]\
-        .to_csv("coefficients_errors_per_year.csv", index=False)
+def has_artifact(key: str)->bool:
+    """
+    This function takes one input:
+    key: an artifact key produced by artifact_key().
 
-    # These lines are meant to investigate the 2020 values a little closer
+    Returns whether an artifact is cached for this key.
+    """
+    return os.path.exists(artifact_path(key)) or os.path.exists(artifact_path(key, "pkl"))
+
+def load_artifact(key: str):
+    """
+    This function takes one input:
+    key: an artifact key produced by artifact_key().
+
+    Returns the cached DataFrame (or other value), or None if there is no artifact for this key.
+    """
+    path = artifact_path(key)
+    if os.path.exists(path):
+        if ARTIFACT_FORMAT == "parquet":
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+    path = artifact_path(key, "pkl")
+    if os.path.exists(path):
+        return pd.read_pickle(path)
+    return None
+
+def store_artifact(key: str, value):
+    """
+    This function takes two inputs:
+    key: an artifact key produced by artifact_key().
+    value: the DataFrame (or other value, such as model results) to cache.
+
+    DataFrames are stored in ARTIFACT_FORMAT and anything else is pickled.
+    The value is written to a temporary file first and then renamed,
+    so a run that gets interrupted never leaves a half-written artifact behind.
+    """
+    os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+    is_df = isinstance(value, pd.DataFrame)
+    path = artifact_path(key) if is_df else artifact_path(key, "pkl")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    if is_df and ARTIFACT_FORMAT == "parquet":
+        value.to_parquet(temp_path)
+    else:
+        pd.to_pickle(value, temp_path)
+    os.replace(temp_path, path)
+
+# Every year of expanded Income by ZIP data is also stored in this one panel table,
+# keyed by (Year, Zipcode) and partitioned into one file per year (see read_panel()).
+PANEL_DIR = "processed_datasets/panel"
+
+# Comparisons that read_panel() filters can use, the same ones pyarrow's filters take.
+PANEL_FILTER_OPERATORS = {"==": operator.eq,
+                          "!=": operator.ne,
+                          "<": operator.lt,
+                          "<=": operator.le,
+                          ">": operator.gt,
+                          ">=": operator.ge,
+                          "in": lambda column, values: column.isin(values),
+                          "not in": lambda column, values: ~column.isin(values)}
+
+def panel_partition_path(year: int, panel_dir: str = PANEL_DIR)->str:
+    """
+    This function takes two inputs:
+    year: a year of the panel.
+    panel_dir: the folder of the panel table.
+
+    Returns the name of the file holding that year of the panel,
+    in a Year=<year> folder like other partitioned datasets use.
+    """
+    return os.path.join(panel_dir, f"Year={year}", f"part.{ARTIFACT_FORMAT}")
+
+def panel_years(panel_dir: str = PANEL_DIR)->list:
+    """
+    This function takes one input:
+    panel_dir: the folder of the panel table.
+
+    Returns the sorted years stored in the panel.
+    """
+    if not os.path.isdir(panel_dir):
+        return []
+    return sorted(int(folder.split("=")[1]) for folder in os.listdir(panel_dir)
+                  if re.fullmatch(r"Year=\d+", folder)
+                  and os.path.exists(panel_partition_path(int(folder.split("=")[1]), panel_dir)))
+
+@traced
+def write_panel_year(df_expanded: pd.DataFrame, year: int, panel_dir: str = PANEL_DIR):
+    """
+    This function takes three inputs:
+    df_expanded: a DataFrame of expanded Income by ZIP data.
+    year: the year the data corresponds to.
+    panel_dir: the folder of the panel table.
+
+    Saves the year's partition of the panel, sorted by Zipcode, in ARTIFACT_FORMAT
+    (a columnar parquet file when pyarrow is installed), with the compact dtypes of
+    EXPANDED_SCHEMA. The file is written to a temporary file first and then renamed.
+    """
+    path = panel_partition_path(year, panel_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df_year = apply_schema(df_expanded, EXPANDED_SCHEMA).sort_values("Zipcode")\
+                                                       .reset_index(drop=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    if ARTIFACT_FORMAT == "parquet":
+        df_year.to_parquet(temp_path, index=False)
+    else:
+        pd.to_pickle(df_year, temp_path)
+    os.replace(temp_path, path)
+
+@traced
+def read_panel(columns: list = None,
+               years: list = None,
+               filters: list = None,
+               panel_dir: str = PANEL_DIR)->pd.DataFrame:
+    """
+    This function takes four inputs:
+    columns: the columns to read (every column if not given).
+    years: the years to read (every year in the panel if not given).
+    filters: a list of (column, comparison, value) conditions that every row has to meet,
+    using the comparisons in PANEL_FILTER_OPERATORS, e.g. [("Borough", "==", "Bronx")].
+    panel_dir: the folder of the panel table.
+
+    Only the files of the given years are opened. With parquet files, only the given columns
+    are read from them and the filters are applied while reading; otherwise each year's file
+    is loaded and then cut down.
+
+    Returns a DataFrame with a Year and a Zipcode column followed by the given columns,
+    sorted by Year and Zipcode.
+
+    Example: the Low H/H Ratio of every Bronx ZIP from 2015 to 2021
+    read_panel(["Low H/H Ratio"], range(2015, 2022), [("Borough", "==", "Bronx")])
+    """
+    stored_years = panel_years(panel_dir)
+    years = stored_years if years is None else sorted(set(years) & set(stored_years))
+    filters = filters or []
+    if columns is not None:
+        columns = ["Zipcode"] + [col for col in columns if col not in ["Year", "Zipcode"]]
+
+    df_years = []
+    for year in years:
+        path = panel_partition_path(year, panel_dir)
+        if ARTIFACT_FORMAT == "parquet":
+            df_year = pd.read_parquet(path, columns=columns, filters=filters or None)
+        else:
+            df_year = pd.read_pickle(path)
+            for column, comparison, value in filters:
+                df_year = df_year[PANEL_FILTER_OPERATORS[comparison](df_year[column], value)]
+            if columns is not None:
+                df_year = df_year[columns]
+        df_years.append(df_year.assign(Year=year))
+    if not df_years:
+        return pd.DataFrame(columns=["Year"] + (columns or ["Zipcode"]))
+    df_panel = pd.concat(df_years, ignore_index=True)
+    return df_panel[["Year"] + [col for col in df_panel.columns if col != "Year"]]
+
+# Fingerprints of the step graph nodes as of the last time each of them ran.
+PIPELINE_STATE_FILE = os.path.join(ARTIFACT_CACHE_DIR, "pipeline_state.json")
+
+class StepNode:
+    """
+    One project step for one data set, as a node of the step graph (see build_step_graph()).
+
+    A node's fingerprint is a hash of its parameters, the contents of the files it reads
+    and the fingerprints of the nodes it depends on. A node whose fingerprint has not
+    changed since it last ran (and whose outputs still exist) does not need to run again.
+    """
+    def __init__(self, name: str, run, inputs: list = (), files: list = (),
+                 params: dict = None, outputs: list = (), cached: bool = True,
+                 main_process: bool = False):
+        """
+        This function takes eight inputs:
+        name: a unique name for the node.
+        run: a function that is called with the values of the input nodes (in order)
+        and returns this node's value.
+        inputs: names of the nodes this node depends on.
+        files: names of the files this node reads directly.
+        params: any other values the node's output depends on (must be JSON serializable).
+        outputs: names of the files this node writes.
+        cached: whether the node's value is stored in the artifact cache.
+        Nodes that only write files (graphs) are not cached, and must not be used as inputs.
+        main_process: whether the node must run in the main process (e.g. it draws graphs).
+        """
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.params = params if params is not None else {}
+        self.outputs = list(outputs)
+        self.cached = cached
+        self.main_process = main_process
+
+    def fingerprint(self, input_fingerprints: dict)->str:
+        """
+        This function takes one input:
+        input_fingerprints: a dict of node names and fingerprints,
+        containing at least every node this node depends on.
+
+        Returns the fingerprint of this node.
+        """
+        return artifact_key(self.name,
+                            [file_digest(file_name) for file_name in self.files] +
+                            [input_fingerprints[name] for name in self.inputs],
+                            self.params)
+
+def discover_years(raw_folder: str)->list:
+    """
+    This function takes one input:
+    raw_folder: the folder containing the raw Income by ZIP files.
+
+    Returns the sorted list of years with a NYC_income_by_zip_[year].csv file in the folder.
+    """
+    years = []
+    for file_name in os.listdir(raw_folder):
+        match = re.fullmatch(r"NYC_income_by_zip_(\d{4})\.csv", file_name)
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+@traced
+def clean_housing_step(import_name: str,
+                       savefile_name: str,
+                       zip_index: ZipIndex = None,
+                       chunksize: int = None)->pd.DataFrame:
+    """
+    Step 1: clean up the Affordable Housing data, as a step graph node.
+
+    This function takes four inputs:
+    import_name: name of a Affordable Housing .csv file to import data from.
+    savefile_name: name of a .csv file to save cleaned data to, or None to skip saving.
+    zip_index: a ZipIndex to get the default post-codes from (loaded if not given).
+    chunksize: if given, the data is read, cleaned and saved this many rows at a time
+    (see import_housing_chunks()), and each chunk is only kept as its housing_buckets().
+    Memory use then depends on the chunk size and the number of buckets, not on the size
+    of the file.
+
+    Most of the actual work occurs in import_housing.
+
+    Returns the cleaned Affordable Housing DataFrame, or with a chunksize,
+    the buckets of every building (which HousingTotals and rollup_housing() take as well).
+    """
+    print("Beginning step 1: importing Affordable Housing data")
+    if chunksize is None:
+        df_housing = import_housing(import_name, HOUSING_COLUMNS, zip_index)
+        if savefile_name is not None:
+            df_housing.to_csv(savefile_name, index=False)
+        return df_housing
+
+    df_buckets = []
+    for df_chunk in import_housing_chunks(import_name, HOUSING_COLUMNS, chunksize, zip_index):
+        if savefile_name is not None:
+            df_chunk.to_csv(savefile_name, index=False,
+                            mode="a" if df_buckets else "w", header=not df_buckets)
+        df_buckets.append(housing_buckets(df_chunk))
+    # the chunks' buckets overlap, merging them adds those up
+    return housing_buckets(pd.concat(df_buckets, ignore_index=True))
+
+@traced
+def clean_income_step(import_name: str, savefile_name: str, year: int)->pd.DataFrame:
+    """
+    Step 2: clean up the Income by ZIP data, as a step graph node.
+
+    This function takes three inputs:
+    import_name: the name of an Income by ZIP .csv file to read from.
+    savefile_name: the name of a .csv file to save cleaned income data to, or None.
+    year: the year the Income by ZIP data corresponds to.
+
+    This function is sort of a wrapper function for import_income().
+
+    Returns the cleaned Income by ZIP DataFrame.
+    """
+    print(f"Beginning Step 2: cleaning Income by ZIP data for year {year}")
+    df_zip_income = import_income(import_name, year)
+    if savefile_name is not None:
+        df_zip_income.to_csv(savefile_name, index=True)
+    return df_zip_income
+
+@traced
+def expand_income_step(df_zip_income: pd.DataFrame,
+                       df_housing,
+                       savefile_name: str,
+                       year: int,
+                       zip_index: ZipIndex = None)->pd.DataFrame:
+    """
+    Step 3: add to the Income by ZIP data columns of possibly useful data,
+    as a step graph node (see expand_income()).
+
+    This function takes five inputs:
+    df_zip_income: a DataFrame of cleaned Income by ZIP data.
+    df_housing: a DataFrame of cleaned Affordable Housing data, or its HousingTotals.
+    savefile_name: the name of a csv file to save expanded Income by ZIP data to, or None.
+    year: a cutoff that tells the code to drop all rows with completion years after it.
+    zip_index: a ZipIndex to get boroughs from (loaded if not given).
+
+    Returns the expanded Income by ZIP DataFrame.
+    """
+    print(f"Beginning Step 3: adding data to Income by ZIP data for year {year}")
+    df_expanded = expand_income(df_zip_income, df_housing, year, zip_index)
+    if savefile_name is not None:
+        df_expanded.to_csv(savefile_name, index=False)
+    return df_expanded
+
+@traced
+def rollup_housing_step(df_housing: pd.DataFrame, savefile_name: str, years: list)->pd.DataFrame:
+    """
+    The affordable housing totals of every geographic level as a step graph node.
+
+    This function takes three inputs:
+    df_housing: a DataFrame of cleaned Affordable Housing data.
+    savefile_name: the name of a csv file to save the rollup to, or None.
+    years: completion year cutoffs to add the units up for.
+
+    Returns the rollup DataFrame (see rollup_housing()).
+    """
+    print("Adding up affordable housing by city, borough, NTA, census tract and zip")
+    df_rollup = rollup_housing(df_housing, years)
+    if savefile_name is not None:
+        df_rollup.to_csv(savefile_name, index=False)
+    return df_rollup
+
+@traced
+def year_model_step(df_expanded: pd.DataFrame, year: int)->HHRatioModel:
+    """
+    Step 5 (without graphs) for one year as a step graph node.
+
+    This function takes two inputs:
+    df_expanded: a DataFrame of expanded Income by ZIP data.
+    year: the year the data corresponds to.
+
+    Returns the year's fitted HHRatioModel (see fit_year_models()).
+    The model is also saved to MODEL_REGISTRY_DIR.
+    """
+    models, _ = fit_year_models({year: df_expanded}, registry_dir=MODEL_REGISTRY_DIR)
+    return models[year]
+
+@traced
+def models_step(years: list, *year_models)->tuple:
+    """
+    Gathers the models of every year as one step graph node.
+
+    This function takes two or more inputs:
+    years: the years that were modeled.
+    year_models: the fitted HHRatioModel of every year, in the same order as years.
+
+    Returns the same two values as fit_year_models().
+    """
+    return dict(zip(years, year_models)), \
+        coefficients_frame([model_summary_row(model) for model in year_models])
+
+@traced
+def bootstrap_step(years: list, fitted_models: tuple, *dfs_expanded):
+    """
+    This function takes three or more inputs:
+    years: the years that were modeled.
+    fitted_models: the output of fit_year_models() for those years.
+    dfs_expanded: the expanded Income by ZIP DataFrame of every year, in the same order as years.
+
+    Bootstraps every year's model (see bootstrap_year_models()) and saves the confidence bands
+    of the prediction lines and of the coefficients to .csv files.
+    """
+    df_bands, df_coef_bands = bootstrap_year_models(dict(zip(years, dfs_expanded)),
+                                                    fitted_models[0])
+    df_bands.to_csv("bootstrap_prediction_bands_per_year.csv", index=False)
+    df_coef_bands.to_csv("bootstrap_coefficient_bands_per_year.csv", index=False)
+
+@traced
+def regression_graphs_step(df_expanded: pd.DataFrame, model: HHRatioModel, year: int,
+                           figures: list = None):
+    """
+    This function takes four inputs:
+    df_expanded: a DataFrame of expanded Income by ZIP data.
+    model: the year's fitted HHRatioModel.
+    year: the year the data corresponds to.
+    figures: a list to queue the graphs in (see queue_figure()).
+
+    Draws the scatterplot with regression line and the regression error graph (Step 5.5)
+    of the year's fitted model, the same one that is saved to the model registry.
+    """
+    predict(df_expanded,
+            f"visualizations/NYC_Household_vs_Income_with_regression_{year}.png",
+            f"visualizations/Regression_error_graph_{year}.png", graphing=True, year=year,
+            figures=figures, model=model)
+
+@traced
+def investigate_year_step(df_expanded: pd.DataFrame, model: HHRatioModel, year: int,
+                          zips=None, figures: list = None):
+    """
+    This function takes five inputs:
+    df_expanded: a DataFrame of expanded Income by ZIP data.
+    model: the year's fitted HHRatioModel.
+    year: the year the data corresponds to.
+    zips: the already loaded simplified ZCTA geojson, loaded by draw_graphs() if not given.
+    figures: a list to queue the graphs in (see queue_figure()).
+
+    Draws every graph for one year: the Step 4 scatterplot and choropleths
+    and the Step 5.5 regression graphs.
+    """
+    draw_graphs(df_expanded, f"visualizations/nyc_zips_choropleth_{year}.html",
+                year=year, zips=zips, figures=figures)
+    regression_graphs_step(df_expanded, model, year, figures)
+
+# Number of bootstrap resamples per year, and how many of them are refitted together.
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_BATCH_SIZE = 250
+
+def lasso_coordinate_descent(gram: np.ndarray,
+                             feature_target: np.ndarray,
+                             l1_penalty: float,
+                             max_iter: int = 1000,
+                             tol: float = 1e-4)->np.ndarray:
+    """
+    This function takes five inputs:
+    gram: a (problems x features x features) array of centered Gram matrices.
+    feature_target: a (problems x features) array of centered feature-target products.
+    l1_penalty: the Lasso alpha times the number of rows.
+    max_iter: the most passes over the features to make.
+    tol: stop once no coefficient of any problem changed by more than this fraction
+    of that problem's largest coefficient.
+
+    Solves many Lasso problems of the same size at once with the same coordinate descent
+    on Gram matrices that sklearn uses, one feature at a time but every problem in one go.
+    Returns the (problems x features) coefficients.
+    """
+    num_features = feature_target.shape[1]
+    diagonal = np.diagonal(gram, axis1=1, axis2=2)
+    # features without any variance (the bias column) always keep a coefficient of 0
+    usable = diagonal > 0
+    safe_diagonal = np.where(usable, diagonal, 1.0)
+    coefs = np.zeros(feature_target.shape)
+    for _ in range(max_iter):
+        max_change = np.zeros(len(coefs))
+        for feature in range(num_features):
+            old_coef = coefs[:, feature].copy()
+            # correlation of this feature with the residual of all the other features
+            partial = feature_target[:, feature] \
+                - np.einsum("pk,pk->p", gram[:, feature, :], coefs) \
+                + diagonal[:, feature] * old_coef
+            shrunk = np.sign(partial) * np.maximum(np.abs(partial) - l1_penalty, 0.0)
+            coefs[:, feature] = np.where(usable[:, feature],
+                                         shrunk / safe_diagonal[:, feature], 0.0)
+            max_change = np.maximum(max_change, np.abs(coefs[:, feature] - old_coef))
+        if np.all(max_change <= tol * np.abs(coefs).max(axis=1)):
+            break
+    return coefs
+
+def bootstrap_lasso_batch(features: np.ndarray,
+                          target: np.ndarray,
+                          alpha: float,
+                          grid_features: np.ndarray,
+                          seed,
+                          num_resamples: int)->tuple:
+    """
+    This function takes six inputs:
+    features: the polynomial features of a model's training set.
+    target: the H/H ratios of the training set.
+    alpha: the Lasso alpha the model was fitted with.
+    grid_features: the polynomial features of the incomes to predict.
+    seed: seed (or SeedSequence) of the resamples.
+    num_resamples: how many resamples to make.
+
+    Draws the resamples as counts of how many times each row is picked,
+    so every resample's centered Gram matrix comes out of one einsum,
+    and refits the model on all of them together (see lasso_coordinate_descent()).
+    Returns the coefficients, intercepts and grid predictions of every resample.
+    """
+    num_rows = len(target)
+    counts = np.random.default_rng(seed).multinomial(num_rows, np.full(num_rows, 1 / num_rows),
+                                                     size=num_resamples).astype(float)
+    x_means = counts @ features / num_rows
+    y_means = counts @ target / num_rows
+    x_centered = features[np.newaxis, :, :] - x_means[:, np.newaxis, :]
+    y_centered = target[np.newaxis, :] - y_means[:, np.newaxis]
+    gram = np.einsum("ri,rij,rik->rjk", counts, x_centered, x_centered)
+    feature_target = np.einsum("ri,rij,ri->rj", counts, x_centered, y_centered)
+    coefs = lasso_coordinate_descent(gram, feature_target, alpha * num_rows)
+    intercepts = y_means - np.einsum("rj,rj->r", x_means, coefs)
+    return coefs, intercepts, coefs @ grid_features.T + intercepts[:, np.newaxis]
+
+@traced
+def bootstrap_year_models(dfs_expanded: dict,
+                          models: dict,
+                          num_resamples: int = BOOTSTRAP_RESAMPLES,
+                          confidence: float = 0.95,
+                          workers: int = None,
+                          seed: int = 10000)->tuple:
+    """
+    This function takes six inputs:
+    dfs_expanded: a dict of year -> expanded Income by ZIP DataFrame (see Step 3).
+    models: a dict of year -> that year's fitted HHRatioModel (see fit_year_models()).
+    num_resamples: how many bootstrap resamples of each year's training set to refit.
+    confidence: the confidence level of the bands.
+    workers: number of processes the batches of resamples are spread across.
+    None uses one per CPU core, and 1 runs every batch in this process.
+    seed: seed of the resamples.
+
+    Refits each year's model (same degree and alpha) on bootstrap resamples
+    of its training set, in batches of BOOTSTRAP_BATCH_SIZE resamples.
+
+    Returns two DataFrames:
+    confidence bands of the prediction line (see prediction_line()) of every year,
+    and confidence bands of the intercept and coefficients of every year's model.
+    """
+    print("Bootstrapping the predictive models of", len(models), "years")
+    years = sorted(models)
+    grid_x, _ = prediction_line(models[years[0]])
+    task_years = []
+    task_args = []
+    for year in years:
+        x_train, _, y_train, _ = split_model_data(dfs_expanded[year])
+        model = models[year]
+        batch_seeds = np.random.SeedSequence([seed, year]).spawn(
+            -(-num_resamples // BOOTSTRAP_BATCH_SIZE))
+        for batch, batch_seed in enumerate(batch_seeds):
+            task_years.append(year)
+            task_args.append((model.features(x_train), np.asarray(y_train, dtype=float),
+                              float(model.regressor.alpha), model.features(grid_x), batch_seed,
+                              min(BOOTSTRAP_BATCH_SIZE,
+                                  num_resamples - batch * BOOTSTRAP_BATCH_SIZE)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(task_args))) as pool:
+            batch_results = list(pool.map(bootstrap_lasso_batch, *zip(*task_args)))
+    else:
+        batch_results = [bootstrap_lasso_batch(*args) for args in task_args]
+    results = {year: [] for year in years}
+    for year, batch_result in zip(task_years, batch_results):
+        results[year].append(batch_result)
+
+    lower_q, upper_q = 50 * (1 - confidence), 50 * (1 + confidence)
+    band_frames = []
+    coef_rows = []
+    for year in years:
+        coefs = np.concatenate([result[0] for result in results[year]])
+        intercepts = np.concatenate([result[1] for result in results[year]])
+        grid_predictions = np.concatenate([result[2] for result in results[year]])
+        band_frames.append(pd.DataFrame({
+            "Year": year,
+            "Median income (dollars)": grid_x,
+            "Predicted H/H Ratio": models[year].predict(grid_x),
+            "Lower": np.percentile(grid_predictions, lower_q, axis=0),
+            "Upper": np.percentile(grid_predictions, upper_q, axis=0)}))
+        estimates = np.concatenate([[models[year].regressor.intercept_],
+                                    models[year].regressor.coef_])
+        samples = np.column_stack([intercepts, coefs])
+        names = ["Intercept"] + [f"var{power}" for power in range(coefs.shape[1])]
+        for name, estimate, column in zip(names, estimates, samples.T):
+            # adding 0.0 turns the -0.0 of coefficients Lasso zeroed out into 0.0
+            coef_rows.append([year, name, estimate, np.percentile(column, lower_q) + 0.0,
+                              np.percentile(column, upper_q) + 0.0])
+    df_coef_bands = pd.DataFrame(coef_rows,
+                                 columns=["Year", "Coefficient", "Estimate", "Lower", "Upper"])
+    return pd.concat(band_frames, ignore_index=True), df_coef_bands
+
+@traced
+def summarize_models(years: list, fitted_models: tuple, figures: list = None):
+    """
+    This function takes three inputs:
+    years: the years that were modeled.
+    fitted_models: the output of fit_year_models() for those years.
+    figures: a list to queue the graph in (see queue_figure()). If not given,
+    the graph is drawn and shown right away.
+
+    Graphs the prediction lines of every year on one figure and saves the
+    summary row of every year's model to coefficients_errors_per_year.csv.
+    """
+    # dictionary of years and corresponding line colors.
+    # 2020 is in blue to highlight the fact that its model is weird and should be investigated
+    # years that are not in here (newer data sets) are drawn in bright red.
+    line_colors_dict = {2021: "#ff0000",
+                        2020: "#0000dd",
+                        2019: "#bb0000",
+                        2018: "#990000",
+                        2017: "#880000",
+                        2016: "#770000",
+                        2015: "#660000",
+                        2014: "#550000",
+                        2013: "#330000",
+                        2012: "#110000",
+                        2011: "#000000"}
+
+    models, predictions_df = fitted_models
+    lines = []
+    for year in years:
+        x_test, y_predicted = prediction_line(models[year])
+
+        # add regression line to graph
+        lines.append((x_test, y_predicted, line_colors_dict.get(year, "#ff0000")))
+        # couldn't figure out a way to manipulate predictions_df to fit into sns
+        # to neatly produce a bunch of lines based on x-vals, y-vals, and year
+        # so instead here's a less elegant solution of adding each line individually
+
+    queue_figure(figures, draw_predictions_overlaid, lines=lines,
+                 title=f"Predictive models from {years[0]} (black) to {years[-1]} (red)",
+                 filename=f"visualizations/NYC_Housing_vs_Income_{years[0]}-{years[-1]}"
+                 "_predictions_overlaid.png")
+
+    #print("printing full predictions df before it is saved to csv:")
+    #print(predictions_df)
+    predictions_df.to_csv("coefficients_errors_per_year.csv", index=False)
+
+class PipelineSession:
+    """
+    Keeps the data sets shared by the project steps in memory for one run.
+
+    The Affordable Housing data, the zip/borough table and the ZCTA geojson are each parsed
+    the first time a step needs them, and every year's cleaned data, expanded data and model
+    are kept after they are made, so each step hands its DataFrame straight to the next one.
+    Writing the cleaned and expanded data sets to .csv files is optional.
+
+    Example:
+    session = PipelineSession()
+    session.expanded(2019).query("Zipcode == 11372")
+    """
+    def __init__(self,
+                 housing_csv: str = "Affordable_Housing_Production_by_Building.csv",
+                 zips_csv: str = "nyc_zipcodes_and_boros.csv",
+                 geojson_name: str = "nyc-zip-code-tabulation-areas-polygons.geojson",
+                 write_csv: bool = False,
+                 housing_chunksize: int = None):
+        """
+        This function takes five inputs:
+        housing_csv: name of the raw Affordable Housing .csv file.
+        zips_csv: name of the .csv file of NYC boroughs and zip codes.
+        geojson_name: name of the .geojson file of NYC ZIP code tabulation areas.
+        write_csv: whether the cleaned and expanded data sets are also saved to .csv files.
+        housing_chunksize: if given, the Affordable Housing data is cleaned this many rows
+        at a time (see clean_housing_step()).
+        """
+        self.housing_csv = housing_csv
+        self.zips_csv = zips_csv
+        self.geojson_name = geojson_name
+        self.write_csv = write_csv
+        self.housing_chunksize = housing_chunksize
+        self._cleaned = {}
+        self._expanded = {}
+        self._year_models = {}
+
+    @functools.cached_property
+    def zip_index(self)->ZipIndex:
+        """
+        The ZipIndex of zips_csv.
+        """
+        return load_zip_index(self.zips_csv)
+
+    @functools.cached_property
+    def housing(self)->pd.DataFrame:
+        """
+        The cleaned Affordable Housing data (Step 1), or only its buckets
+        if the data is cleaned in chunks (see clean_housing_step()).
+        """
+        savefile_name = "AHP_by_Building_cleaned.csv" if self.write_csv else None
+        return clean_housing_step(self.housing_csv, savefile_name, self.zip_index,
+                                  self.housing_chunksize)
+
+    @functools.cached_property
+    def housing_totals(self)->HousingTotals:
+        """
+        The affordable housing unit sums of every year cutoff (see HousingTotals).
+        """
+        return HousingTotals(self.housing)
+
+    @functools.cached_property
+    def zcta_geojson(self):
+        """
+        The simplified ZCTA geojson used by the choropleth maps (see load_simplified_zcta()).
+        """
+        return load_simplified_zcta(self.geojson_name)
+
+    def cleaned(self, year: int)->pd.DataFrame:
+        """
+        This function takes one input:
+        year: a year with a raw Income by ZIP file.
+
+        Returns the cleaned Income by ZIP data for that year (Step 2).
+        """
+        if year not in self._cleaned:
+            savefile_name = f"processed_datasets/NYC_Income_by_ZIP_{year}_Cleaned.csv"
+            self._cleaned[year] = \
+                clean_income_step(f"raw_datasets/NYC_income_by_zip_{year}.csv",
+                                  savefile_name if self.write_csv else None, year)
+        return self._cleaned[year]
+
+    def expanded(self, year: int)->pd.DataFrame:
+        """
+        This function takes one input:
+        year: a year with a raw Income by ZIP file.
+
+        Returns the expanded Income by ZIP data for that year (Step 3).
+        """
+        if year not in self._expanded:
+            savefile_name = f"processed_datasets/NYC_Income_by_ZIP_{year}_Expanded.csv"
+            self._expanded[year] = \
+                expand_income_step(self.cleaned(year), self.housing_totals,
+                                   savefile_name if self.write_csv else None, year,
+                                   self.zip_index)
+        return self._expanded[year]
+
+    def models(self, years: list)->tuple:
+        """
+        This function takes one input:
+        years: the years to model.
+
+        Returns the fitted model and coefficients of every year, fitted together
+        (see fit_year_models()) or loaded from MODEL_REGISTRY_DIR if their data has not changed.
+        """
+        key = tuple(sorted(years))
+        if key not in self._year_models:
+            self._year_models[key] = \
+                fit_year_models({year: self.expanded(year) for year in years},
+                                registry_dir=MODEL_REGISTRY_DIR)
+        return self._year_models[key]
+
+    def draw_graphs(self, year: int, figures: list = None):
+        """
+        This function takes two inputs:
+        year: a year with a raw Income by ZIP file.
+        figures: a list to queue the graphs in (see queue_figure()).
+
+        Draws every graph for that year (Steps 4 and 5.5).
+        """
+        self.draw_graphs_for(self.expanded(year), self.models([year])[0][year], year, figures)
+
+    def draw_graphs_for(self, df_expanded: pd.DataFrame, model: HHRatioModel, year: int,
+                        figures: list = None):
+        """
+        This function takes four inputs:
+        df_expanded: a DataFrame of expanded Income by ZIP data made outside this session.
+        model: the year's fitted HHRatioModel.
+        year: the year the data corresponds to.
+        figures: a list to queue the graphs in (see queue_figure()).
+
+        Draws every graph for that year (Steps 4 and 5.5) using this session's geojson.
+        """
+        investigate_year_step(df_expanded, model, year, self.zcta_geojson, figures)
+
+    def summarize_models(self, years: list, figures: list = None):
+        """
+        This function takes two inputs:
+        years: the years to compare.
+        figures: a list to queue the graph in (see queue_figure()).
+
+        Graphs and saves the models of every year (see summarize_models()).
+        """
+        summarize_models(years, self.models(years), figures)
+
+def build_step_graph(years: list,
+                     write_csv: bool = True,
+                     session: PipelineSession = None,
+                     figures: list = None)->list:
+    """
+    This function takes four inputs:
+    years: the years of Income by ZIP data to process.
+    write_csv: whether the cleaned and expanded data sets are also exported to .csv files.
+    session: a PipelineSession whose shared tables are used by the graph drawing nodes.
+    figures: a list the graph drawing nodes queue their graphs in (see queue_figure()).
+    If not given, the graphs are drawn and shown as the nodes run.
+
+    Declares the project steps as a graph of StepNodes:
+    raw files -> cleaned (Steps 1, 2) -> expanded (Step 3) -> panel table and model (Step 5)
+    -> graphs (Steps 4, 5.5) and the cross-year summary.
+
+    Returns the list of nodes, ordered so every node comes after the nodes it depends on.
+    """
+    if session is None:
+        session = PipelineSession(write_csv=write_csv)
+    housing_csv = session.housing_csv
+    zips_csv = session.zips_csv
+
+    # this only needs to be done once, since housing data for all years are all in one csv.
+    housing_savefile = "AHP_by_Building_cleaned.csv" if write_csv else None
+    nodes = [StepNode("housing_cleaned",
+                      functools.partial(clean_housing_step, housing_csv, housing_savefile,
+                                        session.zip_index, session.housing_chunksize),
+                      files=[housing_csv, zips_csv, session.geojson_name],
+                      params={"columns": HOUSING_COLUMNS,
+                              "chunksize": session.housing_chunksize},
+                      outputs=[housing_savefile] if write_csv else [])]
+
+    # the unit sums of every year cutoff, so the years below share one pass over the buildings
+    nodes.append(StepNode("housing_totals", HousingTotals, inputs=["housing_cleaned"],
+                          params={"units": HOUSING_UNIT_COLUMNS}))
+
+    # the same totals for every year at the NTA, tract and borough levels, for reporting
+    rollup_savefile = "processed_datasets/AHP_rollup_by_area.csv" if write_csv else None
+    nodes.append(StepNode("housing_rollup",
+                          functools.partial(rollup_housing_step, savefile_name=rollup_savefile,
+                                            years=years),
+                          inputs=["housing_cleaned"],
+                          params={"years": years, "levels": ROLLUP_GROUPING_SETS},
+                          outputs=[rollup_savefile] if write_csv else []))
+
+    # the steps below are repeated for every year-based zipcode income prediction.
+    # they are grouped by step so that the years of one step can run side by side.
+    for year in years:
+        savefile = f"processed_datasets/NYC_Income_by_ZIP_{year}_Cleaned.csv" \
+            if write_csv else None
+        nodes.append(StepNode(f"income_cleaned_{year}",
+                              functools.partial(clean_income_step,
+                                                f"raw_datasets/NYC_income_by_zip_{year}.csv",
+                                                savefile, year),
+                              files=[f"raw_datasets/NYC_income_by_zip_{year}.csv"],
+                              params={"year": year},
+                              outputs=[savefile] if write_csv else []))
+    for year in years:
+        savefile = f"processed_datasets/NYC_Income_by_ZIP_{year}_Expanded.csv" \
+            if write_csv else None
+        nodes.append(StepNode(f"income_expanded_{year}",
+                              functools.partial(expand_income_step,
+                                                savefile_name=savefile, year=year,
+                                                zip_index=session.zip_index),
+                              inputs=[f"income_cleaned_{year}", "housing_totals"],
+                              files=[zips_csv],
+                              params={"year": year},
+                              outputs=[savefile] if write_csv else []))
+    # every year is also saved to the (Year, Zipcode) panel table
+    for year in years:
+        nodes.append(StepNode(f"panel_{year}",
+                              functools.partial(write_panel_year, year=year),
+                              inputs=[f"income_expanded_{year}"],
+                              params={"year": year},
+                              outputs=[panel_partition_path(year)],
+                              cached=False))
+    # every year's model is its own node, so adding a year doesn't refit (or redraw) the others
+    for year in years:
+        nodes.append(StepNode(f"model_{year}",
+                              functools.partial(year_model_step, year=year),
+                              inputs=[f"income_expanded_{year}"],
+                              params={"year": year},
+                              outputs=[model_registry_path(year)]))
+    nodes.append(StepNode("models",
+                          functools.partial(models_step, years),
+                          inputs=[f"model_{year}" for year in years],
+                          params={"years": years}))
+
+    # confidence bands of every year's model. this runs its own process pool
+    nodes.append(StepNode("bootstrap_bands",
+                          functools.partial(bootstrap_step, years),
+                          inputs=["models"] + [f"income_expanded_{year}" for year in years],
+                          params={"resamples": BOOTSTRAP_RESAMPLES},
+                          outputs=["bootstrap_prediction_bands_per_year.csv",
+                                   "bootstrap_coefficient_bands_per_year.csv"],
+                          cached=False, main_process=True))
+
+    # preliminary prediction on the 2021 data set and drawing a regression graph
+    if 2021 in years:
+        nodes.append(StepNode("regression_graphs_2021",
+                              functools.partial(regression_graphs_step, year=2021,
+                                                figures=figures),
+                              inputs=["income_expanded_2021", "model_2021"],
+                              outputs=["visualizations/"
+                                       "NYC_Household_vs_Income_with_regression_2021.png",
+                                       "visualizations/Regression_error_graph_2021.png"],
+                              cached=False, main_process=True))
+
+    # making models for every data set and graphing them all at once
+    nodes.append(StepNode("model_summary",
+                          functools.partial(summarize_models, years, figures=figures),
+                          inputs=["models"],
+                          params={"years": years},
+                          outputs=["coefficients_errors_per_year.csv",
+                                   f"visualizations/NYC_Housing_vs_Income_"
+                                   f"{years[0]}-{years[-1]}_predictions_overlaid.png"],
+                          cached=False, main_process=True))
+
+    # These lines are meant to investigate the 2020 values a little closer
     # becase the regression line for 2021 breaks the trend formed by the other reg lines.
     # See the "2011-2021 predictions" graph and line 837/838 comments for more context.
     # Previously they were for 2021 and produced the scatterplot with regression and
     # regression error graphs for that year.
-    draw_graphs("processed_datasets/NYC_Income_by_ZIP_2020_Expanded.csv",
-                "visualizations/nyc_zips_choropleth_2020.html", year=2020)
-    predict("processed_datasets/NYC_Income_by_ZIP_2020_expanded.csv",
-            "visualizations/NYC_Household_vs_Income_with_regression_2020.png",
-            "visualizations/Regression_error_graph_2020.png", year=2020, graphing=True)
+    if 2020 in years:
+        nodes.append(StepNode("investigate_2020",
+                              functools.partial(session.draw_graphs_for, year=2020,
+                                                figures=figures),
+                              inputs=["income_expanded_2020", "model_2020"],
+                              outputs=["visualizations/NYC_Housing_to_Household_by_ZIP_2020.png",
+                                       "visualizations/nyc_zips_choropleth_2020.html",
+                                       "visualizations/nyc_zips_income_2020_choropleth.html",
+                                       ZCTA_GEOMETRY_ASSET,
+                                       "visualizations/"
+                                       "NYC_Household_vs_Income_with_regression_2020.png",
+                                       "visualizations/Regression_error_graph_2020.png"],
+                              cached=False, main_process=True))
+    return nodes
+
+def load_pipeline_state()->dict:
+    """
+    Returns the fingerprint every step graph node had the last time it ran
+    (see run_step_graph()), or an empty dict if nothing has run yet.
+    """
+    if not os.path.exists(PIPELINE_STATE_FILE):
+        return {}
+    with open(PIPELINE_STATE_FILE, mode="r", encoding="utf_8") as state_file:
+        return json.load(state_file)
+
+def up_to_date_outputs(nodes: list, names: list)->bool:
+    """
+    This function takes two inputs:
+    nodes: a list of StepNodes, ordered so every node comes after the nodes it depends on.
+    names: names of some of those nodes.
+
+    Returns whether every one of the named nodes last ran with its current fingerprint
+    and its output files still exist, so the files can be read instead of rerunning it.
+    """
+    fingerprints = {}
+    for node in nodes:
+        fingerprints[node.name] = node.fingerprint(fingerprints)
+    state = load_pipeline_state()
+    nodes_by_name = {node.name: node for node in nodes}
+    return all(state.get(name) == fingerprints[name] and
+               all(os.path.exists(output) for output in nodes_by_name[name].outputs)
+               for name in names)
+
+def run_step_graph(nodes: list, workers: int = None, use_cache: bool = True)->list:
+    """
+    This function takes three inputs:
+    nodes: a list of StepNodes, ordered so every node comes after the nodes it depends on.
+    workers: number of processes to use. None uses one per CPU core,
+    and 1 runs every node in this process.
+    use_cache: set to False to run every node and not touch the artifact cache.
+
+    Runs every stale node: nodes that never ran, whose fingerprint changed since they
+    last ran, or whose outputs (files or cached value) are missing.
+    Up to date nodes are skipped, and their values are only loaded from the artifact cache
+    if a stale node needs them. Stale nodes that do not need the main process are run in
+    a process pool while later nodes are being scheduled.
+
+    Returns the names of the nodes that were run.
+    """
+    nodes_by_name = {node.name: node for node in nodes}
+    fingerprints = {}
+    for node in nodes:
+        fingerprints[node.name] = node.fingerprint(fingerprints)
+
+    state = load_pipeline_state() if use_cache else {}
+
+    def is_stale(node: StepNode)->bool:
+        if not use_cache or state.get(node.name) != fingerprints[node.name]:
+            return True
+        if node.cached and not has_artifact(fingerprints[node.name]):
+            return True
+        return any(not os.path.exists(output) for output in node.outputs)
+
+    stale_names = [node.name for node in nodes if is_stale(node)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool_nodes = [name for name in stale_names if not nodes_by_name[name].main_process]
+    workers = min(workers, len(pool_nodes))
+
+    values = {}
+    pending = {}
+
+    def finish(name: str, value):
+        values[name] = value
+        if not use_cache:
+            return
+        if nodes_by_name[name].cached:
+            store_artifact(fingerprints[name], value)
+        state[name] = fingerprints[name]
+        os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+        with open(f"{PIPELINE_STATE_FILE}.tmp", mode="w", encoding="utf_8") as state_file:
+            json.dump(state, state_file, indent=1)
+        os.replace(f"{PIPELINE_STATE_FILE}.tmp", PIPELINE_STATE_FILE)
+
+    def value_of(name: str):
+        if name in pending:
+            value, events = pending.pop(name).result()
+            TRACER.events += events
+            finish(name, value)
+        if name not in values:
+            values[name] = load_artifact(fingerprints[name])
+        return values[name]
+
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as pool:
+        for node in nodes:
+            if node.name not in stale_names:
+                print(f"Skipping {node.name}: up to date")
+                continue
+            input_values = [value_of(name) for name in node.inputs]
+            if pool is not None and not node.main_process:
+                pending[node.name] = pool.submit(call_traced, node.run, *input_values)
+            else:
+                finish(node.name, node.run(*input_values))
+        for name in list(pending):
+            value_of(name)
+    return stale_names
+
+class ZipYearTable:
+    """
+    Every expanded year of Income by ZIP data in memory, indexed by (Zipcode, Year),
+    with each row's predicted H/H ratio and every year's model for new predictions.
+
+    Rows are stored as ready to send dicts, so a point lookup is one dict lookup,
+    and each year's zip codes are kept sorted so a range of zip codes is two binary searches.
+
+    Example:
+    table = ZipYearTable.from_session(PipelineSession())
+    table.point(11372, 2019)["Housing to Households Ratio"]
+    """
+    def __init__(self, dfs_expanded: dict, models: dict):
+        """
+        This function takes two inputs:
+        dfs_expanded: a dict of year -> expanded Income by ZIP DataFrame (see Step 3).
+        models: a dict of year -> that year's fitted HHRatioModel.
+        """
+        self.models = models
+        self.years = sorted(dfs_expanded)
+        self.rows = {}
+        self.zips_by_year = {}
+        for year in self.years:
+            df_year = dfs_expanded[year].sort_values("Zipcode").assign(Year=year)
+            df_year["Predicted H/H Ratio"] = \
+                models[year].predict(df_year["Median income (dollars)"])
+            # the float32 columns only hold 3 decimals (see INCOME_SCHEMA), rounding them
+            # as float64 keeps float32 digits like 0.0430000015 out of the JSON
+            float32_columns = df_year.columns[df_year.dtypes == np.float32]
+            df_year[float32_columns] = df_year[float32_columns].astype(float).round(3)
+            # to_json turns every numpy value into a plain JSON one in one go
+            records = json.loads(df_year.to_json(orient="records"))
+            zips = df_year["Zipcode"].to_numpy(dtype=int)
+            self.zips_by_year[year] = zips
+            self.rows.update(zip(zip(zips.tolist(), [year] * len(zips)), records))
+
+    @classmethod
+    def from_session(cls, session, years: list = None):
+        """
+        This function takes two inputs:
+        session: a PipelineSession to get the expanded data and models from.
+        years: the years to load. Every year with a raw Income by ZIP file if not given.
+
+        Returns a ZipYearTable of those years.
+        """
+        if years is None:
+            years = discover_years("raw_datasets")
+        models, _ = session.models(years)
+        return cls({year: session.expanded(year) for year in years}, models)
+
+    @classmethod
+    def from_panel(cls, years: list = None):
+        """
+        This function takes one input:
+        years: the years to load. Every year with a raw Income by ZIP file if not given.
+
+        Loads the panel table (see read_panel()) and the model registry (see load_model())
+        that the last pipeline run saved, without running any step again.
+
+        Returns a ZipYearTable of those years, or None if the raw files changed since
+        the pipeline last saved the panel table or the models of those years.
+        """
+        if years is None:
+            years = discover_years("raw_datasets")
+        with redirect_stdout(io.StringIO()):
+            nodes = build_step_graph(years)
+        if not up_to_date_outputs(nodes, [f"{step}_{year}" for step in ["model", "panel"]
+                                          for year in years]):
+            return None
+        df_panel = read_panel(years=years)
+        dfs_expanded = {year: df_panel[df_panel["Year"] == year].drop(columns="Year")
+                        for year in years}
+        return cls(dfs_expanded, {year: load_model(year) for year in years})
+
+    def point(self, zipcode: int, year: int):
+        """
+        This function takes two inputs:
+        zipcode: a zip code (10000 is all of NYC).
+        year: a year.
+
+        Returns the row of that zip code and year, or None if there is none.
+        """
+        return self.rows.get((zipcode, year))
+
+    def zip_years(self, zipcode: int, first_year: int = None, last_year: int = None)->list:
+        """
+        This function takes three inputs:
+        zipcode: a zip code.
+        first_year, last_year: the range of years to return (inclusive), all years if not given.
+
+        Returns the rows of that zip code for every year in the range that has one.
+        """
+        first_year = self.years[0] if first_year is None else first_year
+        last_year = self.years[-1] if last_year is None else last_year
+        return [self.rows[(zipcode, year)] for year in self.years
+                if first_year <= year <= last_year and (zipcode, year) in self.rows]
+
+    def year_zips(self, year: int, first_zip: int = 0, last_zip: int = 99999)->list:
+        """
+        This function takes three inputs:
+        year: a year.
+        first_zip, last_zip: the range of zip codes to return (inclusive).
+
+        Returns the rows of that year for every zip code in the range.
+        """
+        zips = self.zips_by_year.get(year, np.array([], dtype=int))
+        start = np.searchsorted(zips, first_zip, side="left")
+        end = np.searchsorted(zips, last_zip, side="right")
+        return [self.rows[(zipcode, year)] for zipcode in zips[start:end].tolist()]
+
+    def predict(self, year: int, incomes: list):
+        """
+        This function takes two inputs:
+        year: a year with a model.
+        incomes: a list of median incomes.
+
+        Returns the predicted H/H ratio of every income (an empty list for no incomes),
+        or None if the year has no model.
+        """
+        if year not in self.models:
+            return None
+        if len(incomes) == 0:
+            return []
+        return self.models[year].predict(incomes).tolist()
+
+# Port the query server listens on (on localhost only).
+QUERY_SERVER_PORT = 8042
+# Query string parameters of the query server that are integers.
+QUERY_RANGE_PARAMETERS = ["first_year", "last_year", "first_zip", "last_zip"]
+# What the query server answers a request with malformed parameters with.
+QUERY_ERROR_MESSAGE = "zip codes, years and their ranges must be integers, " \
+                      "and incomes must be finite numbers"
+# What the query server answers incomes too large or small to predict for with.
+QUERY_INCOME_RANGE_MESSAGE = "incomes are too far out of range to predict for"
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET requests against the server's ZipYearTable with JSON:
+    /zip/<zipcode>/<year>                         one row
+    /zip/<zipcode>?first_year=...&last_year=...   one zip code over a range of years
+    /year/<year>?first_zip=...&last_zip=...       one year over a range of zip codes
+    /predict/<year>?income=...&income=...         predicted H/H ratios of some incomes
+    """
+    # keep connections open so clients don't pay for a new connection per request
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, and with Nagle's algorithm on
+    # the body would wait for the client's delayed ACK (about 40 ms) on every request
+    disable_nagle_algorithm = True
+
+    def send_json(self, status: int, value):
+        """
+        This function takes two inputs:
+        status: the HTTP status code.
+        value: the JSON serializable response body.
+        """
+        body = json.dumps(value, allow_nan=False).encode("utf_8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Routes one GET request (see the class docstring).
+        """
+        table = self.server.table
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        query = parse_qs(url.query)
+        if not ((parts[0] == "zip" and len(parts) in (2, 3)) or
+                (parts[0] in ("year", "predict") and len(parts) == 2)):
+            self.send_json(404, {"error": "unknown path"})
+            return
+
+        # every parameter is checked before the table is touched,
+        # and bad ones get a fixed message instead of the parser's
+        try:
+            numbers = [int(part) for part in parts[1:]]
+            ranges = {name: int(query[name][0]) for name in QUERY_RANGE_PARAMETERS
+                      if name in query}
+            incomes = [float(income) for income in query.get("income", [])]
+        except ValueError:
+            self.send_json(400, {"error": QUERY_ERROR_MESSAGE})
+            return
+        if not np.isfinite(incomes).all():
+            self.send_json(400, {"error": QUERY_ERROR_MESSAGE})
+            return
+
+        if parts[0] == "zip" and len(parts) == 3:
+            result = table.point(*numbers)
+        elif parts[0] == "zip":
+            result = table.zip_years(numbers[0], ranges.get("first_year"),
+                                     ranges.get("last_year"))
+        elif parts[0] == "year":
+            result = table.year_zips(numbers[0], ranges.get("first_zip", 0),
+                                     ranges.get("last_zip", 99999))
+        else:
+            result = table.predict(numbers[0], incomes)
+            # incomes far outside the data make the polynomial overflow,
+            # and JSON has no infinities to send back
+            if result is not None and not np.isfinite(result).all():
+                self.send_json(400, {"error": QUERY_INCOME_RANGE_MESSAGE})
+                return
+        if result is None:
+            self.send_json(404, {"error": "no data for this zip code and/or year"})
+        else:
+            self.send_json(200, result)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """
+        Requests are not logged, printing every one of them would be the slowest part.
+        """
+
+def serve(port: int = QUERY_SERVER_PORT, session=None):
+    """
+    This function takes two inputs:
+    port: the port to listen on.
+    session: a PipelineSession to load the data and models from. If not given, the panel
+    table and model registry of the last pipeline run are loaded instead, and a new
+    session only runs the steps if they are missing.
+
+    Loads every year into a ZipYearTable and answers queries (see QueryRequestHandler)
+    on localhost until interrupted.
+    """
+    table = ZipYearTable.from_panel() if session is None else None
+    if table is None:
+        print("Running the pipeline steps, the panel table or model registry is not up to date")
+        table = ZipYearTable.from_session(session if session is not None else PipelineSession())
+    server = ThreadingHTTPServer(("127.0.0.1", port), QueryRequestHandler)
+    server.table = table
+    print(f"Serving {len(server.table.rows)} (Zipcode, Year) rows on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def load_test(port: int = QUERY_SERVER_PORT, num_requests: int = 5000, seed: int = 0)->dict:
+    """
+    This function takes three inputs:
+    port: the port a query server is listening on (see serve()).
+    num_requests: how many requests to send.
+    seed: seed of the random mix of requests.
+
+    Sends a random mix of point lookups (most of them), zip code and year ranges and
+    predictions over one kept-alive connection, one request at a time.
+    Returns (and prints) the p50 and p99 latencies in milliseconds and the requests per second.
+    """
+    rng = np.random.default_rng(seed)
+    zips = load_zip_index().zips
+    years = discover_years("raw_datasets")
+    paths = []
+    for kind in rng.choice(["point", "zip", "year", "predict"], size=num_requests,
+                           p=[0.7, 0.1, 0.1, 0.1]):
+        zipcode, year = int(rng.choice(zips)), int(rng.choice(years))
+        if kind == "point":
+            paths.append(f"/zip/{zipcode}/{year}")
+        elif kind == "zip":
+            paths.append(f"/zip/{zipcode}?first_year={year}")
+        elif kind == "year":
+            paths.append(f"/year/{year}?first_zip={zipcode}&last_zip={zipcode + 50}")
+        else:
+            incomes = rng.integers(10000, 200000, size=10)
+            paths.append(f"/predict/{year}?" + "&".join(f"income={income}" for income in incomes))
+
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = np.empty(num_requests)
+    start = time.perf_counter()
+    for i, path in enumerate(paths):
+        sent = time.perf_counter()
+        connection.request("GET", path)
+        connection.getresponse().read()
+        latencies[i] = time.perf_counter() - sent
+    elapsed = time.perf_counter() - start
+    connection.close()
+
+    results = {"requests": num_requests,
+               "p50_ms": float(np.percentile(latencies, 50) * 1000),
+               "p99_ms": float(np.percentile(latencies, 99) * 1000),
+               "requests_per_second": num_requests / elapsed}
+    print(f"{num_requests} requests: p50 {results['p50_ms']:.3f} ms, "
+          f"p99 {results['p99_ms']:.3f} ms, {results['requests_per_second']:.0f} requests/s")
+    return results
+
+# Sizes the benchmark suite runs the pipeline at, as (buildings, ZIP codes).
+# The first is about the size of the repo's sample data.
+BENCHMARK_SIZES = [(6335, 180), (100000, 2000), (1000000, 20000)]
+# Where the benchmark suite keeps the results it compares against.
+BENCHMARK_BASELINE_FILE = "benchmark_baseline.json"
+# A step is flagged as a regression if it takes this many times its baseline time or memory,
+# and (for time) at least this many seconds more, since very short steps are noisy.
+BENCHMARK_REGRESSION_RATIO = 1.25
+BENCHMARK_NOISE_SECONDS = 0.05
+# Share of the synthetic buildings without a Postcode (about the share in the real data).
+# Half of them still have coordinates, so the spatial join is measured too.
+SYNTHETIC_MISSING_POSTCODE_SHARE = 0.21
+# Boroughs of the synthetic buildings, with the codes used in community boards and NTAs.
+SYNTHETIC_BOROUGH_CODES = {"Bronx": "BX",
+                           "Brooklyn": "BK",
+                           "Manhattan": "MN",
+                           "Queens": "QN",
+                           "Staten Island": "SI"}
+
+def synthetic_dates(rng, count: int, first_year: int, num_years: int,
+                    missing_share: float)->pd.Series:
+    """
+    This function takes five inputs:
+    rng: a numpy random Generator.
+    count: the number of dates.
+    first_year: the earliest year a date can be in.
+    num_years: the number of years the dates are spread over.
+    missing_share: the share of dates left missing.
+
+    Returns a Series of MM/DD/YYYY dates, like the dates in the AHP data.
+    """
+    days = pd.to_timedelta(rng.integers(0, num_years * 365, count), unit="D")
+    dates = pd.Series((pd.Timestamp(year=first_year, month=1, day=1) + days)
+                      .strftime("%m/%d/%Y"), dtype=object)
+    dates[rng.random(count) < missing_share] = np.nan
+    return dates
+
+def make_synthetic_housing(num_buildings: int, zips: np.ndarray, seed: int = 0)->pd.DataFrame:
+    """
+    This function takes three inputs:
+    num_buildings: the number of buildings to make.
+    zips: the ZIP codes the buildings are spread over.
+    seed: the random seed.
+
+    Returns a made up Affordable Housing Production by Building table with the columns
+    (and the same kinds of values and missing values) of the real .csv file.
+    """
+    rng = np.random.default_rng(seed)
+    boroughs = np.array(list(SYNTHETIC_BOROUGH_CODES))[rng.integers(0, 5, num_buildings)]
+    borough_codes = pd.Series(boroughs).map(SYNTHETIC_BOROUGH_CODES).to_numpy(dtype=object)
+    no_postcode = rng.random(num_buildings) < SYNTHETIC_MISSING_POSTCODE_SHARE
+    no_address = no_postcode & (rng.random(num_buildings) < 0.5)
+
+    def with_address(values):
+        # buildings without an address have no BBL, coordinates, tract, etc.
+        return pd.Series(values).where(~no_address)
+
+    latitudes = rng.uniform(40.50, 40.91, num_buildings)
+    longitudes = rng.uniform(-74.25, -73.70, num_buildings)
+    # the income units of every band, and the units without a band
+    band_units = rng.poisson([4, 6, 10, 4, 2, 1], size=(num_buildings, 6))
+    counted_units = band_units.sum(axis=1)
+    rental_units = rng.binomial(counted_units, 0.8)
+    bedroom_units = rng.multinomial(1, [0.2, 0.35, 0.3, 0.1, 0.02, 0.01, 0.02],
+                                    size=num_buildings) * counted_units[:, None]
+    project_ids = rng.integers(40000, 80000, num_buildings)
+    return pd.DataFrame({
+        "Project ID": project_ids,
+        "Project Name": [f"SYNTHETIC PROJECT {project_id}" for project_id in project_ids],
+        "Project Start Date": synthetic_dates(rng, num_buildings, 2014, 10, 0.0),
+        "Project Completion Date": synthetic_dates(rng, num_buildings, 2014, 10, 0.3),
+        "Building ID": with_address(rng.integers(1, 1000000, num_buildings)),
+        "Number": rng.integers(1, 3000, num_buildings).astype(str),
+        "Street": "SYNTHETIC AVENUE",
+        "Borough": boroughs,
+        "Postcode": pd.Series(zips[rng.integers(0, len(zips), num_buildings)])\
+            .where(~no_postcode),
+        "BBL": with_address(rng.integers(1000000000, 5999999999, num_buildings)),
+        "BIN": with_address(rng.integers(1000000, 5999999, num_buildings)),
+        "Community Board": borough_codes + "-" +
+                           pd.Series(rng.integers(1, 19, num_buildings)).map("{:02d}".format),
+        "Council District": rng.integers(1, 52, num_buildings),
+        "Census Tract": with_address(rng.integers(1, 150000, num_buildings).astype(str)),
+        "NTA - Neighborhood Tabulation Area": with_address(
+            borough_codes + pd.Series(rng.integers(1, 100, num_buildings)).map("{:02d}".format)),
+        "Latitude": with_address(latitudes),
+        "Longitude": with_address(longitudes),
+        "Latitude (Internal)": with_address(latitudes + rng.normal(0, 1e-4, num_buildings)),
+        "Longitude (Internal)": with_address(longitudes + rng.normal(0, 1e-4, num_buildings)),
+        "Building Completion Date": synthetic_dates(rng, num_buildings, 2014, 10, 0.27),
+        "Reporting Construction Type": np.where(rng.random(num_buildings) < 0.55,
+                                                "Preservation", "New Construction"),
+        "Extended Affordability Only": np.where(rng.random(num_buildings) < 0.15, "Yes", "No"),
+        "Prevailing Wage Status": np.where(rng.random(num_buildings) < 0.02,
+                                           "Prevailing Wage", "Non Prevailing Wage"),
+        "Extremely Low Income Units": band_units[:, 0],
+        "Very Low Income Units": band_units[:, 1],
+        "Low Income Units": band_units[:, 2],
+        "Moderate Income Units": band_units[:, 3],
+        "Middle Income Units": band_units[:, 4],
+        "Other Income Units": band_units[:, 5],
+        "Studio Units": bedroom_units[:, 0],
+        "1-BR Units": bedroom_units[:, 1],
+        "2-BR Units": bedroom_units[:, 2],
+        "3-BR Units": bedroom_units[:, 3],
+        "4-BR Units": bedroom_units[:, 4],
+        "5-BR Units": bedroom_units[:, 5],
+        "6-BR+ Units": 0,
+        "Unknown-BR Units": bedroom_units[:, 6],
+        "Counted Rental Units": rental_units,
+        "Counted Homeownership Units": counted_units - rental_units,
+        "All Counted Units": counted_units,
+        "Total Units": counted_units + rng.poisson(1, num_buildings)})
+
+def write_synthetic_income(csv_name: str, zips: np.ndarray, year: int, seed: int = 0):
+    """
+    This function takes four inputs:
+    csv_name: the name of the .csv file to write.
+    zips: the ZIP codes to make up data for.
+    year: the year the file pretends to be from (it changes one label, see impute_income()).
+    seed: the random seed.
+
+    Writes a made up Income by ZIP file laid out like the ones downloaded from the Census:
+    one row per statistic, one column per area and household type, and values written
+    as text like "12,997", "8.3%" and "(X)". About 1 in 50 ZIPs has no households.
+    """
+    rng = np.random.default_rng(seed)
+    num_areas = len(zips) + 1
+    totals = rng.integers(100, 40000, num_areas) * (rng.random(num_areas) >= 0.02)
+    shares = np.round(rng.dirichlet(np.ones(len(INCOME_BRACKET_COLUMNS)), num_areas) * 100, 1)
+    medians = rng.integers(20000, 250000, num_areas)
+    totals[0], medians[0] = totals[1:].sum(), int(np.median(medians[1:]))
+
+    def as_text(values, text_format: str)->list:
+        return [text_format.format(value) for value in values]
+
+    # one list of values per statistic, the household types of an area share the same values
+    statistics = [["Total", as_text(totals, "{:,}")]] + \
+        [[f"\xa0\xa0\xa0\xa0{bracket}", as_text(shares[:, position], "{:.1f}%")]
+         for position, bracket in enumerate(INCOME_BRACKET_COLUMNS)] + \
+        [["Median income (dollars)", as_text(medians, "{:,}")],
+         ["Mean income (dollars)", as_text(medians * 14 // 10, "{:,}")],
+         ["PERCENT IMPUTED" if year <= 2015 else "PERCENT ALLOCATED", [""] * num_areas],
+         ["\xa0\xa0\xa0\xa0Household income in the past 12 months",
+          as_text(rng.uniform(10, 50, num_areas), "{:.1f}%")],
+         ["\xa0\xa0\xa0\xa0Family income in the past 12 months", ["(X)"] * num_areas],
+         ["\xa0\xa0\xa0\xa0Nonfamily income in the past 12 months", ["(X)"] * num_areas]]
+
+    household_types = ["Households", "Families", "Married-couple families", "Nonfamily households"]
+    areas = ["New York city, New York"] + [f"ZCTA5 {zipcode}" for zipcode in zips]
+    with open(csv_name, mode="w", encoding="utf_8_sig", newline="") as income_file:
+        writer = csv.writer(income_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(["Label (Grouping)"] + [f"{area}!!{household_type}!!Estimate"
+                                                for area in areas
+                                                for household_type in household_types])
+        for label, values in statistics:
+            writer.writerow([label] + [value for value in values
+                                       for _ in household_types])
+
+def measure_step(step, *args)->tuple:
+    """
+    This function takes one or more inputs:
+    step: a function to measure.
+    args: the arguments to call it with.
+
+    Runs step(*args) twice: once timed, and once with tracemalloc on to find the most memory
+    it had allocated at once (tracemalloc slows things down, so it is not on for the timing).
+    Whatever the step prints is hidden.
+
+    Returns the step's output, the seconds it took and its peak memory in MB.
+    """
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        output = step(*args)
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        try:
+            step(*args)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return output, seconds, peak_bytes / 2**20
+
+def draw_benchmark_graphs(df_expanded: pd.DataFrame, year: int, zips: dict):
+    """
+    This function takes three inputs:
+    df_expanded: a DataFrame of expanded Income by ZIP data.
+    year: the year the data corresponds to.
+    zips: the simplified ZCTA geojson.
+
+    Draws every Step 4 graph of the data in this process with the headless backend.
+    """
+    figures = []
+    draw_graphs(df_expanded, f"visualizations/nyc_zips_choropleth_{year}.html", year, zips, figures)
+    render_figures(figures, workers=1)
+
+def benchmark_pipeline(num_buildings: int, num_zips: int, zips_geojson: dict,
+                       year: int = 2021, seed: int = 0)->list:
+    """
+    This function takes five inputs:
+    num_buildings: the number of synthetic buildings.
+    num_zips: the number of synthetic ZIP codes.
+    zips_geojson: the simplified ZCTA geojson used by the choropleth maps.
+    year: the year the synthetic Income by ZIP data is for.
+    seed: the random seed of the synthetic data.
+
+    Makes synthetic data sets of the given size in a temporary folder and measures
+    (see measure_step()) every step of the pipeline on them, in order:
+    import_housing, import_income, expand_income, find_best_degree, predict and draw_graphs.
+
+    Returns a list of [step, buildings, ZIP codes, seconds, peak MB] rows.
+    """
+    rows = []
+
+    def record(step_name: str, step, *args):
+        output, seconds, peak_mb = measure_step(step, *args)
+        rows.append([step_name, num_buildings, num_zips, seconds, peak_mb])
+        print(f"{step_name} ({num_buildings} buildings, {num_zips} ZIPs): "
+              f"{seconds:.3f} seconds, {peak_mb:.1f} MB")
+        return output
+
+    zips = 10001 + np.arange(num_zips)
+    working_folder = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        housing_csv = os.path.join(folder, "housing.csv")
+        income_csv = os.path.join(folder, "income.csv")
+        make_synthetic_housing(num_buildings, zips, seed).to_csv(housing_csv, index=False)
+        write_synthetic_income(income_csv, zips, year, seed)
+
+        df_housing = record("import_housing", import_housing, housing_csv, HOUSING_COLUMNS)
+        df_zip_income = record("import_income", import_income, income_csv, year)
+        df_expanded = record("expand_income", expand_income, df_zip_income, df_housing, year)
+        x_train, _, y_train, _ = split_model_data(df_expanded)
+        record("find_best_degree", find_best_degree, x_train, y_train)
+        record("predict", predict, df_expanded, None, None, False, year)
+        # the graphs are saved to the temporary folder
+        os.makedirs(os.path.join(folder, "visualizations"))
+        os.chdir(folder)
+        try:
+            record("draw_graphs", draw_benchmark_graphs, df_expanded, year, zips_geojson)
+        finally:
+            os.chdir(working_folder)
+    return rows
+
+def compare_benchmarks(df_results: pd.DataFrame, df_baseline: pd.DataFrame)->pd.DataFrame:
+    """
+    This function takes two inputs:
+    df_results: benchmark results (see run_benchmarks()).
+    df_baseline: earlier benchmark results to compare against.
+
+    Returns df_results with the baseline time and memory of every step and size,
+    the ratios of the two, and whether the step regressed (see BENCHMARK_REGRESSION_RATIO).
+    Steps and sizes missing from the baseline have no ratios and never count as regressions.
+    """
+    df_compared = df_results.merge(df_baseline, how="left", on=["Step", "Buildings", "ZIP codes"],
+                                   suffixes=("", " (Baseline)"))
+    df_compared["Time Ratio"] = df_compared["Seconds"] / df_compared["Seconds (Baseline)"]
+    df_compared["Memory Ratio"] = df_compared["Peak MB"] / df_compared["Peak MB (Baseline)"]
+    slower = (df_compared["Time Ratio"] > BENCHMARK_REGRESSION_RATIO) & \
+        (df_compared["Seconds"] - df_compared["Seconds (Baseline)"] > BENCHMARK_NOISE_SECONDS)
+    df_compared["Regression"] = slower | \
+        (df_compared["Memory Ratio"] > BENCHMARK_REGRESSION_RATIO)
+    return df_compared
+
+def run_benchmarks(sizes: list = None,
+                   baseline_file: str = BENCHMARK_BASELINE_FILE,
+                   save_baseline: bool = False,
+                   seed: int = 0)->pd.DataFrame:
+    """
+    This function takes four inputs:
+    sizes: a list of (buildings, ZIP codes) sizes to benchmark at (BENCHMARK_SIZES if not given).
+    baseline_file: the .json file of the baseline results.
+    save_baseline: set to True to save these results as the new baseline.
+    seed: the random seed of the synthetic data.
+
+    Benchmarks every pipeline step at every size (see benchmark_pipeline()) and compares the
+    results with the baseline, printing any regressions. If there is no baseline yet,
+    these results become the baseline.
+
+    Returns the results, compared with the baseline (see compare_benchmarks()).
+    """
+    if sizes is None:
+        sizes = BENCHMARK_SIZES
+    use_headless_backend()
+    # loaded up front so neither is timed as part of a step
+    zips_geojson = load_simplified_zcta("nyc-zip-code-tabulation-areas-polygons.geojson")
+    load_zcta_index()
+    rows = []
+    for num_buildings, num_zips in sizes:
+        rows += benchmark_pipeline(num_buildings, num_zips, zips_geojson, seed=seed)
+    df_results = pd.DataFrame(rows, columns=["Step", "Buildings", "ZIP codes",
+                                             "Seconds", "Peak MB"])
+
+    if save_baseline or not os.path.exists(baseline_file):
+        df_results.to_json(baseline_file, orient="records", indent=1)
+        print(f"Saved the results as the baseline in {baseline_file}")
+        return compare_benchmarks(df_results, df_results)
+    df_compared = compare_benchmarks(df_results, pd.read_json(baseline_file, orient="records"))
+    print(df_compared[["Step", "Buildings", "ZIP codes", "Seconds", "Time Ratio",
+                       "Peak MB", "Memory Ratio"]].to_string(index=False))
+    df_regressions = df_compared[df_compared["Regression"]]
+    if df_regressions.empty:
+        print("No regressions against the baseline")
+    else:
+        print(f"{len(df_regressions)} regressions against the baseline:")
+        print(df_regressions[["Step", "Buildings", "ZIP codes"]].to_string(index=False))
+    return df_compared
+
+# Seed of the random data the self-checks run on, so every run checks the same cases.
+SELFCHECK_SEED = 0
+# Training set sizes the degree sweep is checked at, and how many training sets of each size.
+SELFCHECK_DEGREE_SIZES = [15, 40, 200]
+SELFCHECK_DEGREE_SETS = 10
+# Shape of the batches of Lasso problems checked, as (problems, rows, features),
+# and how many batches are checked.
+SELFCHECK_LASSO_SHAPE = (6, 50, 5)
+SELFCHECK_LASSO_BATCHES = 8
+# Number of random points placed into ZCTAs, and how many of them have no coordinates.
+SELFCHECK_ZCTA_POINTS = 5000
+SELFCHECK_ZCTA_MISSING = 50
+
+def reference_best_degree(x_train, y_train, max_degree: int = 11)->tuple:
+    """
+    This function takes three inputs:
+    x_train: a training set of incomes.
+    y_train: a training set of H/H ratios.
+    max_degree: the highest polynomial degree to try.
+
+    The original degree sweep, refitting PolynomialFeatures + LinearRegression for every
+    degree. Only used to check find_best_degree() against.
+    Returns the best degree and the MSE for that degree.
+    """
+    degree_error_combo = [-1, 2**32]
+    min_error_threshold = 0.05
+    for degree in range(1, max_degree + 1):
+        poly_features = PolynomialFeatures(degree=degree).fit_transform(x_train.to_frame())
+        reg = linear_model.LinearRegression().fit(poly_features, y_train)
+        error = mean_squared_error(y_train, reg.predict(poly_features))
+        if error < degree_error_combo[1]:
+            if 1.0 - abs(error / degree_error_combo[1]) > min_error_threshold:
+                degree_error_combo[0] = degree
+                degree_error_combo[1] = error
+            else:
+                break
+        else:
+            break
+    return degree_error_combo[0], degree_error_combo[1]
+
+def selfcheck_find_best_degree(rng: np.random.Generator)->list:
+    """
+    This function takes one input:
+    rng: the random generator to make the training sets with.
+
+    Compares find_best_degree() with reference_best_degree() on noisy polynomials of
+    degree 1 to 7. The incomes are drawn in [-1, 1], since the reference fit itself breaks
+    down on raw incomes (the fitted errors don't depend on how the incomes are scaled).
+    Returns a description of every training set the two disagree on.
+    """
+    failures = []
+    for num_rows in SELFCHECK_DEGREE_SIZES:
+        for _ in range(SELFCHECK_DEGREE_SETS):
+            x_train = pd.Series(rng.uniform(-1, 1, num_rows))
+            chebyshev_coefs = rng.normal(size=rng.integers(2, 9))
+            y_train = pd.Series(np.polynomial.chebyshev.chebval(x_train, chebyshev_coefs)
+                                + rng.normal(0, 0.05, num_rows))
+            # find_best_degree() prints every degree it tries
+            with redirect_stdout(io.StringIO()):
+                degree, error = find_best_degree(x_train, y_train)
+            expected_degree, expected_error = reference_best_degree(x_train, y_train)
+            if degree != expected_degree or not np.isclose(error, expected_error, rtol=1e-6):
+                failures.append(f"{num_rows} rows: degree {degree} with MSE {error}, "
+                                f"expected degree {expected_degree} with MSE {expected_error}")
+    return failures
+
+def selfcheck_lasso_coordinate_descent(rng: np.random.Generator)->list:
+    """
+    This function takes one input:
+    rng: the random generator to make the Lasso problems with.
+
+    Solves batches of random Lasso problems with lasso_coordinate_descent() and compares
+    the coefficients with sklearn's Lasso fitted on each problem on its own.
+    The features include a constant column like the models' polynomial features do,
+    and both solvers run to a tight tolerance so only real differences show.
+    Returns a description of every batch the two disagree on.
+    """
+    failures = []
+    num_problems, num_rows, num_features = SELFCHECK_LASSO_SHAPE
+    for _ in range(SELFCHECK_LASSO_BATCHES):
+        features = np.stack([np.polynomial.chebyshev.chebvander(rng.uniform(-1, 1, num_rows),
+                                                                 num_features - 1)
+                             for _ in range(num_problems)])
+        target = np.einsum("prf,pf->pr", features, rng.normal(size=(num_problems, num_features)))\
+            + rng.normal(0, 0.1, (num_problems, num_rows))
+        alpha = 10 ** rng.uniform(-4, 0)
+        x_centered = features - features.mean(axis=1, keepdims=True)
+        y_centered = target - target.mean(axis=1, keepdims=True)
+        coefs = lasso_coordinate_descent(np.einsum("prj,prk->pjk", x_centered, x_centered),
+                                         np.einsum("prj,pr->pj", x_centered, y_centered),
+                                         alpha * num_rows, max_iter=100000, tol=1e-10)
+        expected = np.stack([linear_model.Lasso(alpha=alpha, tol=1e-12, max_iter=100000)
+                             .fit(features[problem], target[problem]).coef_
+                             for problem in range(num_problems)])
+        if not np.allclose(coefs, expected, atol=1e-6):
+            failures.append(f"alpha {alpha}: coefficients off by up to "
+                            f"{np.abs(coefs - expected).max()}")
+    return failures
+
+def reference_zcta_lookup(zips, points: np.ndarray)->np.ndarray:
+    """
+    This function takes two inputs:
+    zips: a parsed geojson of ZIP code tabulation areas (see load_zcta_geojson()).
+    points: a (points x 2) array of longitudes and latitudes.
+
+    Places every point by testing it against every ring of every polygon in file order,
+    with matplotlib's point in polygon test. A point inside an odd number of a polygon's
+    rings (so not in one of its holes) is inside the polygon. Only used to check
+    ZctaIndex against.
+    Returns the ZCTA of every point, or 0 for points outside every ZCTA.
+    """
+    found = np.zeros(len(points), dtype=np.int64)
+    for feature in zips["features"]:
+        geometry = feature["geometry"]
+        polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" \
+            else geometry["coordinates"]
+        for polygon in polygons:
+            inside = np.zeros(len(points), dtype=bool)
+            for ring in polygon:
+                ring_path = matplotlib.path.Path(np.asarray(ring, dtype=float)[:, :2])
+                inside ^= ring_path.contains_points(points)
+            # the first ZCTA listed wins where they overlap
+            found[inside & (found == 0)] = int(feature["properties"]["postalCode"])
+    return found
+
+def selfcheck_zcta_index(rng: np.random.Generator)->list:
+    """
+    This function takes one input:
+    rng: the random generator to place the points with.
+
+    Builds a ZctaIndex of the NYC ZCTAs and compares its lookup() of random points
+    across the city (a few without coordinates) with reference_zcta_lookup().
+    Returns a description of every point the two disagree on.
+    """
+    zips = load_zcta_geojson("nyc-zip-code-tabulation-areas-polygons.geojson")
+    zcta_index = ZctaIndex(zips)
+    west, south = zcta_index.polygon_bounds[:, :2].min(axis=0)
+    east, north = zcta_index.polygon_bounds[:, 2:].max(axis=0)
+    points = np.column_stack([rng.uniform(west, east, SELFCHECK_ZCTA_POINTS),
+                              rng.uniform(south, north, SELFCHECK_ZCTA_POINTS)])
+    points[rng.choice(SELFCHECK_ZCTA_POINTS, SELFCHECK_ZCTA_MISSING, replace=False)] = np.nan
+    found = zcta_index.lookup(points[:, 0], points[:, 1])
+    expected = reference_zcta_lookup(zips, points)
+    return [f"point {point}: ZCTA {zcta}, expected {expected_zcta}"
+            for point, zcta, expected_zcta in zip(points.tolist(), found, expected)
+            if zcta != expected_zcta]
+
+# The self-checks run by run_selfchecks(), as name -> check function.
+# Each check takes a random generator and returns a list of failures.
+SELFCHECKS = {"find_best_degree": selfcheck_find_best_degree,
+              "lasso_coordinate_descent": selfcheck_lasso_coordinate_descent,
+              "ZctaIndex": selfcheck_zcta_index}
+
+def run_selfchecks(seed: int = SELFCHECK_SEED)->bool:
+    """
+    This function takes one input:
+    seed: the random seed of every check's data.
+
+    Runs every check in SELFCHECKS, each on a fresh generator with the same seed,
+    and prints whether it passed along with its first few failures.
+    Returns True if every check passed.
+    """
+    passed = True
+    for name, check in SELFCHECKS.items():
+        failures = check(np.random.default_rng(seed))
+        print(f"{name}: {'ok' if not failures else f'{len(failures)} failures'}")
+        for failure in failures[:5]:
+            print("   ", failure)
+        passed = passed and not failures
+    return passed
+
+def main(write_csv: bool = True, use_cache: bool = True, workers: int = None,
+         headless: bool = False, trace_file: str = None, housing_chunksize: int = None):
+    """
+    Main function.
+
+    This function takes six inputs:
+    write_csv: whether the cleaned and expanded data sets are also exported to .csv files.
+    use_cache: whether only the stale steps are rerun (see run_step_graph()).
+    workers: number of processes the steps (and in headless mode, the graphs) are spread across.
+    headless: set to True for unattended runs. No graph is shown: every graph is queued
+    while the steps run and they are all drawn at the end, in parallel (see render_figures()).
+    trace_file: if given, every step of the run is traced and the trace is saved to this file
+    (see StepTracer). Setting the PIPELINE_TRACE environment variable does the same.
+    housing_chunksize: if given, the Affordable Housing data is streamed through Step 1
+    this many rows at a time instead of being read all at once.
+
+    Every year with a raw Income by ZIP file in raw_datasets/ is processed.
+    """
+    print("Beginning project steps")
+    if trace_file is not None:
+        # through the environment too, so worker processes trace their steps
+        os.environ[TRACE_ENVIRONMENT_VARIABLE] = trace_file
+        TRACER.trace_file = trace_file
+    # Important: do not include margin of error in the raw csv files
+    years = discover_years("raw_datasets")
+    session = PipelineSession(write_csv=write_csv, housing_chunksize=housing_chunksize)
+    figures = [] if headless else None
+    if headless:
+        use_headless_backend()
+    run_step_graph(build_step_graph(years, write_csv, session, figures), workers, use_cache)
+    if headless:
+        print(f"Drawing {len(figures)} graphs")
+        render_figures(figures, workers)
+    if TRACER.enabled:
+        TRACER.save()
+        print(f"Saved the trace to {TRACER.trace_file}")
+        print(summarize_trace(TRACER.trace_file).to_string())
     # main function ends here
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:3] == ["benchmark", "impute"]:
+        print(benchmark_impute_housing("Affordable_Housing_Production_by_Building.csv",
+                                       [10000, 100000, 1000000, 2000000]))
+    elif sys.argv[1:2] == ["benchmark"]:
+        # python main_project.py benchmark [save], where save makes these results the baseline
+        run_benchmarks(save_baseline=sys.argv[2:3] == ["save"])
+    elif sys.argv[1:2] == ["serve"]:
+        serve(*[int(arg) for arg in sys.argv[2:3]])
+    elif sys.argv[1:2] == ["loadtest"]:
+        # python main_project.py loadtest [port] [number of requests]
+        load_test(*[int(arg) for arg in sys.argv[2:4]])
+    elif sys.argv[1:2] == ["headless"]:
+        main(headless=True)
+    elif sys.argv[1:2] == ["trace"]:
+        # python main_project.py trace [trace file]
+        main(trace_file=(sys.argv[2:3] or ["pipeline_trace.json"])[0])
+    elif sys.argv[1:2] == ["selfcheck"]:
+        sys.exit(0 if run_selfchecks() else 1)
+    elif sys.argv[1:2] == ["stream"]:
+        # python main_project.py stream [rows per chunk]
+        main(housing_chunksize=int((sys.argv[2:3] or [HOUSING_CHUNK_SIZE])[0]))
+    else:
+        main()